@@ -0,0 +1,7 @@
+"""ASGI deployment configurations."""
+
+from django.core.asgi import get_asgi_application
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", 'settings_prod')
+application = get_asgi_application()
@@ -1,6 +1,13 @@
 """Gunicorn configuration used for production web server."""
 
 import multiprocessing
+import os
 
 bind = "unix:/tmp/compclub.sock"
 workers = multiprocessing.cpu_count() * 2 + 1
+
+# To run the ASGI application, set
+# GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker and
+# GUNICORN_APP=asgi:application (see run.sh).
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "sync")
+threads = int(os.environ.get("GUNICORN_THREADS", 1))
@@ -7,26 +7,18 @@ set -euo pipefail
 # python manage.py makemigrations
 # python manage.py migrate --no-input
 
-# Clear old static folder
-rm -r ./static || true
-mkdir -p static
+# Static files are collected and compressed when the image is built (see
+# Dockerfile), just make sure the bundle is complete
+python manage.py check_static
 
-# roll up static files
-python manage.py collectstatic --clear --no-input
+# Run gunicorn, see gunicorn.py for running the ASGI application
+gunicorn -c gunicorn.py "${GUNICORN_APP:-wsgi:application}" &
 
-# Compress and compile the stylesheets
-python manage.py compress --force
+# Deliver queued emails
+python manage.py send_queued_email &
 
-# Compress the images
-python manage.py compress_images ./static/website
-
-
-# Clean up
-find ./static -name "*.scss" -type f -delete
-find ./static -type d -empty -delete
-
-# Run gunicorn
-gunicorn -c gunicorn.py wsgi:application &
+# Compress uploaded images
+python manage.py process_images &
 
 # Run nginx
 mkdir --parents /etc/nginx/
@@ -36,6 +36,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'website.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -49,7 +50,8 @@ ROOT_URLCONF = 'compclub.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that reports render time to the instrumentation
+        'BACKEND': 'website.instrumentation.DjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -130,6 +132,47 @@ COMPRESS_FILTERS = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Embed HTML fetched from noembed.com. Entries never expire on their own;
+    # MAX_ENTRIES bounds the size and NOEMBED_STALE_TTL is set per entry.
+    'noembed': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'noembed',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+
+# NoEmbed lookups (see website.plugins.cms)
+NOEMBED_CACHE_ALIAS = 'noembed'
+NOEMBED_TTL = 60 * 60 * 24  # refresh embeds older than a day
+NOEMBED_STALE_TTL = 60 * 60 * 24 * 30  # serve the last good embed for a month
+NOEMBED_TIMEOUT = 3  # seconds to wait for noembed.com
+NOEMBED_RETRY_DELAY = 60  # seconds between lookups of the same URL
+
+# Rendered event content regions (see website.views.EventPage). Entries are
+# keyed by content version so this only bounds how long embeds are frozen.
+EVENT_CONTENT_CACHE_TTL = 60 * 60
+
+# Request instrumentation (see website.instrumentation)
+# Add a Server-Timing header to every response. Staff always get it.
+SERVER_TIMING = False
+SLOW_REQUEST_THRESHOLD = 1000  # milliseconds, slower requests are logged
+
+# PRAGMAs run on every new SQLite connection (see website.signals). Set in
+# settings_prod, and measured by the bench_sqlite management command.
+SQLITE_PRAGMAS = {}
+
+# Full pages shared between users with the same permissions
+# (see website.caching)
+PAGE_CACHE_TTL = 60 * 10
+
 LOGIN_REDIRECT_URL = 'website:event_index'
 LOGOUT_REDIRECT_URL = 'website:index'
 
@@ -142,3 +185,15 @@ EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')
 EMAIL_USE_TLS = True
 EMAIL = 'compclub-noreply@csesoc.org.au'
+
+# Email queue (see website/management/commands/send_queued_email.py)
+EMAIL_QUEUE_CHUNK_SIZE = 50  # emails sent between progress updates
+EMAIL_QUEUE_MAX_ATTEMPTS = 5
+EMAIL_QUEUE_RETRY_DELAY = 60  # seconds, doubled after each failed attempt
+EMAIL_QUEUE_POLL_INTERVAL = 5  # seconds between checks for new jobs
+EMAIL_QUEUE_LEASE = 600  # seconds before a job left sending is reclaimed
+
+# Uploaded image processing (see website/management/commands/process_images.py)
+IMAGE_QUEUE_POLL_INTERVAL = 5  # seconds between checks for new uploads
+IMAGE_QUEUE_LEASE = 600  # seconds before an image left processing is reclaimed
+IMAGE_RENDITION_WIDTHS = (480, 800, 1200)  # pixels, never scaled up
@@ -6,6 +6,7 @@ from settings import *  # noqa: F401, F403
 
 SECRET_KEY = 'development-only'
 DEBUG = True
+SERVER_TIMING = True
 
 DATABASES = {
     'default': {
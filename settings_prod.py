@@ -19,6 +19,23 @@ STATIC_ROOT = '/app/static'
 
 MEDIA_ROOT = '/data/user-media'
 
+# Cached pages and their version stamp must be shared between gunicorn
+# workers, otherwise saving an event only invalidates one worker's copy.
+CACHES['default'] = {  # noqa: F405
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': '/data/cache/default',
+    'OPTIONS': {'MAX_ENTRIES': 1000},
+}
+
+# Keep embeds on the data volume so they are shared between gunicorn workers
+# and survive restarts.
+CACHES['noembed'] = {  # noqa: F405
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': '/data/cache/noembed',
+    'TIMEOUT': None,
+    'OPTIONS': {'MAX_ENTRIES': 1000},
+}
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -51,7 +68,11 @@ LOGGING = {
             'level': 'INFO',
             'class': 'logging.StreamHandler',
             'formatter': 'django.server',
-        }
+        },
+        'slow_requests': {
+            'level': 'WARNING',
+            'class': 'logging.StreamHandler',
+        },
     },
     'loggers': {
         'django': {
@@ -62,7 +83,12 @@ LOGGING = {
             'handlers': ['django.server'],
             'level': 'INFO',
             'propagate': False,
-        }
+        },
+        'website.slow_requests': {
+            'handlers': ['slow_requests'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     }
 }
 
@@ -71,5 +97,18 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': DB_PATH,
+        # reuse connections between requests instead of reopening the file
+        'CONN_MAX_AGE': 60,
     }
 }
+
+# Every gunicorn worker shares the one database file. WAL lets readers run
+# alongside the single writer, and writers wait for the lock instead of
+# failing with "database is locked".
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'busy_timeout': 5000,  # milliseconds
+    'synchronous': 'normal',  # safe with WAL, skips an fsync per commit
+    'mmap_size': 64 * 1024 * 1024,  # bytes
+    'cache_size': -16 * 1024,  # negative means KiB
+}
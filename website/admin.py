@@ -6,8 +6,8 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.db import models
 
-from website.models import (CustomUser, Download, Event, NoEmbed, Registration,
-                            RichText, Workshop,
+from website.models import (CustomUser, Download, EmailJob, Event, NoEmbed,
+                            Registration, RichText, Workshop,
                             LightBox, Student, School)
 
 
@@ -81,6 +81,7 @@ class RichTextInline(ContentEditorInline):
 class EventAdmin(ContentEditor):
     """Provides a pretty interface for editing content using django-content-editor."""  # noqa: E501
 
+    readonly_fields = ('image_status', 'seats_taken')
     inlines = [
         RichTextInline,
         ContentEditorInline.create(model=Download),
@@ -89,7 +90,28 @@ class EventAdmin(ContentEditor):
     ]
 
 
-admin.site.register(Workshop)
-admin.site.register(Registration)
+@admin.register(Workshop)
+class WorkshopAdmin(admin.ModelAdmin):
+    """Workshop settings, showing how many seats are taken."""
+
+    readonly_fields = ('seats_taken',)
+
+
+@admin.register(Registration)
+class RegistrationAdmin(admin.ModelAdmin):
+    """Registrations, showing which are confirmed and which are waitlisted."""
+
+    list_display = ('name', 'event', 'workshop', 'status')
+    list_filter = ('status',)
+    list_select_related = ('event', 'workshop__event')
+
+    def get_readonly_fields(self, request, obj=None):
+        """Don't move registrations, which would leave their seats behind."""
+        if obj is None:
+            return ('status',)
+        return ('status', 'event', 'workshop')
+
+
 admin.site.register(Student)
 admin.site.register(School)
+admin.site.register(EmailJob)
@@ -5,3 +5,7 @@ from django.apps import AppConfig
 
 class WebsiteConfig(AppConfig):  # noqa
     name = 'website'
+
+    def ready(self):
+        """Connect signal receivers."""
+        from website import signals  # noqa: F401
@@ -0,0 +1,132 @@
+"""
+Caching for pages that are the same for many users.
+
+Provides a server-side page cache and the ETags used to answer conditional
+GETs without rendering a template. Pages vary by user, which Last-Modified
+can't express, so only ETags are used.
+"""
+
+import hashlib
+import uuid
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.html import mark_safe
+
+from website.models import Event
+
+NAVBAR_ACCOUNT_PLACEHOLDER = mark_safe("<!-- navbar-account -->")
+NAVBAR_ACCOUNT_TEMPLATE = "website/components/navbar_account.html"
+
+
+def get_version(name):
+    """Return the current version stamp of a group of cached data."""
+    key = f"version:{name}"
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_version(name):
+    """Invalidate a group of cached data by changing its version stamp."""
+    cache.set(f"version:{name}", uuid.uuid4().hex, None)
+
+
+class PermissionPageCacheMixin:
+    """
+    Cache rendered pages, shared between users with the same permissions.
+
+    Instead of varying on the session, pages are keyed on which of
+    `page_cache_permissions` the user holds, so e.g. all anonymous visitors
+    share one copy. The only per-user part of the page, the account menu in
+    the navbar, is left as a placeholder in the cached copy and rendered for
+    each request.
+    """
+
+    page_cache_permissions = ()
+
+    def get_page_cache_key(self, request):
+        """Return the cache key for the page as seen by the request's user."""
+        held = ",".join(perm for perm in self.page_cache_permissions
+                        if request.user.has_perm(perm))
+        return (f"page:{get_version('page')}:{date.today().isoformat()}:"
+                f"{request.path}:{held}")
+
+    def get_context_data(self, **kwargs):  # noqa: D102
+        context = super().get_context_data(**kwargs)
+        context["navbar_account_placeholder"] = NAVBAR_ACCOUNT_PLACEHOLDER
+        return context
+
+    def dispatch(self, request, *args, **kwargs):
+        """Serve the page from the cache, rendering it on a miss."""
+        if request.method not in ("GET", "HEAD"):
+            return super().dispatch(request, *args, **kwargs)
+
+        key = self.get_page_cache_key(request)
+        content = cache.get(key)
+        if content is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            if hasattr(response, "render"):
+                response.render()
+            content = response.content.decode(response.charset)
+            cache.set(key, content, settings.PAGE_CACHE_TTL)
+
+        account = render_to_string(NAVBAR_ACCOUNT_TEMPLATE, request=request)
+        return HttpResponse(
+            content.replace(NAVBAR_ACCOUNT_PLACEHOLDER, account, 1))
+
+
+def user_etag(request, *parts):
+    """
+    Return an ETag for a page as seen by the request's user.
+
+    Pages show the user's name and depend on their permissions, so both are
+    part of the tag along with the date and the given parts.
+    """
+    user = request.user
+    data = repr((parts, user.pk, sorted(user.get_all_permissions()),
+                 date.today().isoformat()))
+    return hashlib.md5(data.encode()).hexdigest()
+
+
+def _event_list_state(request):
+    """Summarise every event and workshop in one aggregate query."""
+    if not hasattr(request, "_event_list_state"):
+        request._event_list_state = Event.objects.aggregate(
+            events=Count("id", distinct=True),
+            workshops=Count("workshop", distinct=True),
+            event_updated=Max("updated_at"),
+            workshop_updated=Max("workshop__updated_at"),
+        )
+    return request._event_list_state
+
+
+def event_list_etag(request, *args, **kwargs):
+    """Return the ETag of a page listing events."""
+    return user_etag(request, *_event_list_state(request).values())
+
+
+def _event_state(request, event_id):
+    """Return the validators of one event, or None if it doesn't exist."""
+    if not hasattr(request, "_event_state"):
+        request._event_state = Event.objects.filter(pk=event_id).values(
+            "updated_at", "content_version").first()
+    return request._event_state
+
+
+def event_etag(request, event_id, *args, **kwargs):
+    """Return the ETag of an event page."""
+    state = _event_state(request, event_id)
+    if state is None:
+        return None
+    return user_etag(request, event_id, state["content_version"],
+                     state["updated_at"])
@@ -4,12 +4,17 @@ import datetime
 import re
 
 from django import forms
+from django.db import transaction
+from django.db.models import Q
 from django.forms import (DateInput, Form, ModelForm, TimeInput,
                           ValidationError)
+from django.urls import reverse_lazy
 from django.utils.translation import gettext_lazy as _
 
-from website.models import (CustomUser, Event, Registration, Student,
-                            VolunteerAssignment, Workshop)
+from website.caching import bump_version
+from website.models import (CustomUser, Event, Registration, School,
+                            Student, VolunteerAssignment, Workshop)
+from website.utils import recurrence_dates
 
 from django.contrib.auth.password_validation import validate_password
 
@@ -26,6 +31,37 @@ class TimePicker(TimeInput):
     input_type = 'time'
 
 
+class SchoolAutocomplete(forms.Select):
+    """
+    School select that is filled in by searching as the user types.
+
+    Only the selected school is rendered, instead of every school in the
+    database. school-autocomplete.js adds a search box that fetches matching
+    schools from the school search endpoint.
+    """
+
+    def __init__(self, attrs=None):  # noqa: D107
+        default_attrs = {
+            'data-autocomplete-url': reverse_lazy('website:school_search'),
+            'size': '5',
+        }
+        if attrs:
+            default_attrs.update(attrs)
+        super().__init__(default_attrs)
+
+    def optgroups(self, name, value, attrs=None):
+        """Return only the selected school as an option."""
+        selected = [v for v in value if str(v).isdigit()]
+        if not selected:
+            return []
+        schools = self.choices.queryset.filter(pk__in=selected)
+        return [
+            (None, [self.create_option(name, school.pk, str(school), True,
+                                       index)], index)
+            for index, school in enumerate(schools)
+        ]
+
+
 class EventForm(ModelForm):
     """Event creation form. Creates a new Event model object upon saving."""
 
@@ -75,8 +111,25 @@ class WorkshopForm(ModelForm):
     Creates one or more workshops for a specific event upon saving.
     """
 
-    REPEAT_CHOICES = (('NO', 'None'), ('DL', 'Daily'), ('WK', 'Weekly'))
+    REPEAT_CHOICES = (('NO', 'None'), ('DL', 'Daily'),
+                      ('WD', 'Weekdays only'), ('WK', 'Weekly'))
     repeat_workshop = forms.ChoiceField(choices=REPEAT_CHOICES)
+    repeat_interval = forms.IntegerField(
+        min_value=1,
+        initial=1,
+        required=False,
+        help_text=_('Repeat every N days, or every N weeks if weekly'))
+    repeat_count = forms.IntegerField(
+        min_value=1,
+        required=False,
+        help_text=_('Total number of workshops, including the first'))
+    repeat_until = forms.DateField(
+        required=False,
+        widget=DatePicker,
+        help_text=_('Defaults to the end of the event'))
+    skip_dates = forms.CharField(
+        required=False,
+        help_text=_('Comma separated dates to skip, e.g. 2020-04-10'))
 
     def __init__(self, *args, **kwargs):  # noqa: D107
         super(WorkshopForm, self).__init__(*args, **kwargs)
@@ -86,7 +139,8 @@ class WorkshopForm(ModelForm):
     class Meta:  # noqa: D106
         model = Workshop
         fields = ('event', 'start_time', 'end_time', 'date', 'name',
-                  'location', 'repeat_workshop')
+                  'location', 'repeat_workshop', 'repeat_interval',
+                  'repeat_count', 'repeat_until', 'skip_dates')
         exclude = ()
         help_texts = {'time': _('Must be in Sydney time')}
         widgets = {
@@ -96,26 +150,47 @@ class WorkshopForm(ModelForm):
             'date': DatePicker
         }
 
-    def make_recurring_workshops(self, interval):
+    def clean_skip_dates(self):
+        """Parse the comma separated list of dates to skip."""
+        skip = set()
+        for value in re.split(r'[,\s]+', self.cleaned_data['skip_dates']):
+            if not value:
+                continue
+            try:
+                skip.add(datetime.date.fromisoformat(value))
+            except ValueError:
+                raise ValidationError(_('Invalid date to skip: %(date)s'),
+                                      code='invalid date',
+                                      params={'date': value})
+        return skip
+
+    def get_dates(self):
         """
-        Create recurring workshops.
+        Get the dates of every workshop to be created.
 
-        Args:
-            interval: datetime.timedelta object. The time interval between each
-                      workshop
+        Returns:
+            a sorted list of dates, starting with the workshop date
 
         """
         cleaned_data = self.cleaned_data
-        current_date = cleaned_data.get('date') + interval
-        while current_date <= cleaned_data.get('event').finish_date:
-            Workshop.objects.create(
-                event=cleaned_data.get('event'),
-                name=cleaned_data.get('name'),
-                date=current_date,
-                start_time=cleaned_data.get('start_time'),
-                end_time=cleaned_data.get('end_time'),
-                location=cleaned_data.get('location'))
-            current_date += interval
+        start = cleaned_data['date']
+        recurrence = cleaned_data['repeat_workshop']
+        if recurrence == 'NO':
+            return [start]
+
+        interval = cleaned_data.get('repeat_interval') or 1
+        if recurrence == 'WK':
+            interval *= 7
+        finish_date = cleaned_data['event'].finish_date
+        until = cleaned_data.get('repeat_until') or finish_date
+        return recurrence_dates(
+            start,
+            interval=interval,
+            weekdays=range(5) if recurrence == 'WD' else None,
+            # the first workshop always takes place
+            skip=cleaned_data['skip_dates'] - {start},
+            count=cleaned_data.get('repeat_count'),
+            until=min(until, finish_date))
 
     def clean(self):
         """Clean and validate the form data."""
@@ -149,14 +224,49 @@ class WorkshopForm(ModelForm):
                 _('Workshop start time cannot be later than the end time'),
                 code='invalid time')
 
+        repeat_until = cleaned_data.get('repeat_until')
+        if repeat_until is not None and repeat_until < workshop_date:
+            raise ValidationError(
+                _('Workshops cannot repeat until before the first workshop'),
+                code='invalid date')
+
+        if (cleaned_data.get('repeat_workshop') == 'WD'
+                and workshop_date.weekday() >= 5):
+            raise ValidationError(
+                _('Weekday only workshops must start on a weekday'),
+                code='invalid date')
+
+        if ('repeat_workshop' in cleaned_data and 'skip_dates' in cleaned_data
+                and not self.get_dates()):
+            raise ValidationError(
+                _('The repeat settings don\'t create any workshops'),
+                code='invalid recurrence')
+
     def save(self):
-        """Create an object model and save it to the database."""
-        super().save()
-        recurrence = self.cleaned_data['repeat_workshop']
-        if recurrence == 'DL':
-            self.make_recurring_workshops(datetime.timedelta(days=1))
-        elif recurrence == 'WK':
-            self.make_recurring_workshops(datetime.timedelta(days=7))
+        """
+        Create the workshop and its repeats.
+
+        Every occurrence is inserted with a single bulk insert.
+
+        Returns:
+            the first workshop
+
+        """
+        template = self.instance
+        workshops = [
+            Workshop(event=template.event,
+                     name=template.name,
+                     date=date,
+                     start_time=template.start_time,
+                     end_time=template.end_time,
+                     location=template.location)
+            for date in self.get_dates()
+        ]
+        Workshop.objects.bulk_create(workshops)
+        # bulk_create doesn't send post_save
+        bump_version('page')
+        self.instance = workshops[0]
+        return self.instance
 
 
 class CreateUserForm(ModelForm):
@@ -243,6 +353,7 @@ class CreateStudentForm(ModelForm):
                 field.field.widget.attrs['class'] += ' form-control'
             else:
                 field.field.widget.attrs['class'] = 'form-control'
+        self.fields['school'].queryset = School.objects.filter(active=True)
 
     class Meta:  # noqa: D106
         model = Student
@@ -250,16 +361,12 @@ class CreateStudentForm(ModelForm):
 
         help_texts = {
             'school': (
+                'Start typing to search for your school. ' +
                 'If you are home schooled put Home School. ' +
                 'If your school isn\'t in the list put Other.')}
 
         widgets = {
-            'school': forms.Select(
-                attrs={
-                    'class': 'selectpicker form-control',
-                    'data-live-search': 'true',
-                    'data-size': '5'}
-            ),
+            'school': SchoolAutocomplete(),
         }
 
         labels = {
@@ -323,7 +430,8 @@ class VolunteerAssignForm(Form):
 
         Args:
             *args:
-                available: List of available volunteers (Django models)
+                available: List of available volunteers (Django models), with
+                           their users selected
                 assignments: List of volunteer assignments (Django models)
 
         """
@@ -333,33 +441,78 @@ class VolunteerAssignForm(Form):
         assignments = kwargs.pop('assignments')
         super(VolunteerAssignForm, self).__init__(*args, **kwargs)
 
+        # current assignment of each volunteer
+        self.assignments = {a.volunteer_id: a for a in assignments}
+
         # add each available volunteer as a radio ChoiceField
         for v in available:
             user = v.user
-            try:
-                # get current assignment for volunteer
-                status = assignments.get(volunteer=v).status
-                self.fields[f'vol_{v.id}'] = forms.ChoiceField(
-                    widget=forms.RadioSelect(),
-                    choices=VolunteerAssignment.ASSIGN_CHOICES,
-                    initial=status,
-                    label=f'{user.first_name} {user.last_name} ({user.email})')
-            except VolunteerAssignment.DoesNotExist:
-                self.fields[f'vol_{v.id}'] = forms.ChoiceField(
-                    widget=forms.RadioSelect(),
-                    choices=VolunteerAssignment.ASSIGN_CHOICES,
-                    label=f'{user.first_name} {user.last_name} ({user.email})')
+            self.fields[f'vol_{v.id}'] = forms.ChoiceField(
+                widget=forms.RadioSelect(),
+                choices=VolunteerAssignment.ASSIGN_CHOICES,
+                required=False,
+                initial=getattr(self.assignments.get(v.id), 'status', None),
+                label=f'{user.first_name} {user.last_name} ({user.email})')
 
     def get_assignments(self):
-        """Yield collection of assignments received from the form."""
+        """
+        Yield (volunteer id, status) pairs received from the form.
+
+        Volunteers left blank are skipped.
+        """
         for field, value in self.cleaned_data.items():
-            if field.startswith('vol_'):
-                yield (field[4], value)
+            if field.startswith('vol_') and value:
+                yield (int(field[len('vol_'):]), value)
 
-    def save(self):
-        """Save assignment into model."""
+    def get_changes(self):
+        """
+        Diff the submitted statuses against the existing assignments.
+
+        Returns:
+            tuple of (new, changed) lists of VolunteerAssignments
+
+        """
+        new, changed = [], []
         for vol_id, status in self.get_assignments():
-            VolunteerAssignment.objects.update_or_create(
-                workshop_id=self.cleaned_data['workshop_id'],
-                volunteer_id=vol_id,
-                defaults={'status': status})
+            assignment = self.assignments.get(vol_id)
+            if assignment is None:
+                new.append(VolunteerAssignment(
+                    workshop_id=self.cleaned_data['workshop_id'],
+                    volunteer_id=vol_id,
+                    status=status))
+            elif assignment.status != status:
+                assignment.status = status
+                changed.append(assignment)
+        return new, changed
+
+    @staticmethod
+    def save_changes(new, changed):
+        """
+        Write new and changed assignments with a few statements.
+
+        New assignments that were created by someone else since the form was
+        loaded are given the submitted status rather than failing the insert.
+        """
+        changed = list(changed)
+        with transaction.atomic():
+            VolunteerAssignment.objects.bulk_create(new,
+                                                    ignore_conflicts=True)
+            if new:
+                # inserts skipped for a conflict left the existing status
+                statuses = {(a.workshop_id, a.volunteer_id): a.status
+                            for a in new}
+                conflicts = Q()
+                for assignment in new:
+                    conflicts |= Q(workshop_id=assignment.workshop_id,
+                                   volunteer_id=assignment.volunteer_id) \
+                        & ~Q(status=assignment.status)
+                for assignment in VolunteerAssignment.objects \
+                        .filter(conflicts):
+                    assignment.status = statuses[
+                        (assignment.workshop_id, assignment.volunteer_id)]
+                    changed.append(assignment)
+            VolunteerAssignment.objects.bulk_update(changed, ['status'])
+
+    def save(self):
+        """Save assignments into the model in a single transaction."""
+        self.save_changes(*self.get_changes())
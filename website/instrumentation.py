@@ -0,0 +1,156 @@
+"""
+Per-request timing of database, template and outbound HTTP work.
+
+InstrumentationMiddleware reports where each request spent its time in a
+Server-Timing header, to staff or to everyone if SERVER_TIMING is set, and
+logs requests slower than SLOW_REQUEST_THRESHOLD to the
+"website.slow_requests" logger.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends import django as django_backend
+
+logger = logging.getLogger('website.slow_requests')
+
+_timings = ContextVar('request_timings', default=None)
+_active = ContextVar('active_timers', default=frozenset())
+
+
+class RequestTimings:
+    """Time spent and number of calls, by kind of work, for one request."""
+
+    def __init__(self):  # noqa: D107
+        self.durations = defaultdict(float)
+        self.counts = defaultdict(int)
+        # embeds are fetched from several threads at once
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        """Record one call that took some seconds."""
+        with self._lock:
+            self.durations[name] += seconds
+            self.counts[name] += 1
+
+
+@contextmanager
+def timed(name):
+    """
+    Add the time spent in the block to the current request's timings.
+
+    Does nothing outside of a request, or when nested in a block with the
+    same name, so nested template renders aren't counted twice.
+    """
+    timings = _timings.get()
+    active = _active.get()
+    if timings is None or name in active:
+        yield
+        return
+
+    token = _active.set(active | {name})
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+        _active.reset(token)
+
+
+def _time_query(execute, sql, params, many, context):
+    """Database execute wrapper that times every query."""
+    with timed('db'):
+        return execute(sql, params, many, context)
+
+
+class Template(django_backend.Template):
+    """Django template that times its rendering."""
+
+    def render(self, context=None, request=None):  # noqa: D102
+        with timed('template'):
+            return super().render(context, request)
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """Django templates backend whose templates time their rendering."""
+
+    def from_string(self, template_code):  # noqa: D102
+        return Template(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):  # noqa: D102
+        return Template(super().get_template(template_name).template, self)
+
+
+class InstrumentationMiddleware:
+    """
+    Measure each request and report it with Server-Timing.
+
+    Should be first in MIDDLEWARE so the total covers the other middleware.
+    """
+
+    def __init__(self, get_response):  # noqa: D107
+        self.get_response = get_response
+
+    def __call__(self, request):  # noqa: D102
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(_time_query))
+                response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        total = time.perf_counter() - start
+
+        if settings.SERVER_TIMING or getattr(request, '_server_timing', False):
+            response['Server-Timing'] = self.server_timing(timings, total)
+        if total * 1000 >= settings.SLOW_REQUEST_THRESHOLD:
+            self.log_slow_request(request, response, timings, total)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """
+        Check if the request is from a staff member.
+
+        The user is only set by the authentication middleware, and loading
+        it here, rather than once the response is ready, counts its queries
+        in the timings.
+        """
+        if not settings.SERVER_TIMING:
+            user = getattr(request, 'user', None)
+            request._server_timing = user is not None and user.is_staff
+
+    def server_timing(self, timings, total):
+        """Format timings as a Server-Timing header value."""
+        metrics = [f'total;dur={total * 1000:.1f}']
+        for name in ('db', 'template', 'http'):
+            if name in timings.durations:
+                metrics.append(
+                    f'{name};dur={timings.durations[name] * 1000:.1f};'
+                    f'desc="{timings.counts[name]} calls"')
+        return ', '.join(metrics)
+
+    def log_slow_request(self, request, response, timings, total):
+        """Log a slow request as a JSON object."""
+        match = request.resolver_match
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+        }
+        for name, seconds in timings.durations.items():
+            record[f'{name}_ms'] = round(seconds * 1000, 1)
+            record[f'{name}_calls'] = timings.counts[name]
+        logger.warning(json.dumps(record))
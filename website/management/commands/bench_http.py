@@ -0,0 +1,299 @@
+"""Management command to load test the website over HTTP."""
+
+import itertools
+import json
+import random
+import secrets
+import statistics
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from website.models import CustomUser, Event, School
+
+# a different username for every sign up in the run
+_signup_ids = itertools.count()
+
+
+class BenchClient:
+    """
+    One simulated user, with its own HTTP session.
+
+    Each scenario method makes one timed request and returns its latency in
+    seconds, its status code (or "exception" if the request failed) and
+    whether it succeeded. Any requests needed to set a scenario
+    up, like fetching a CSRF token, are not timed.
+    """
+
+    def __init__(self, base_url, credentials, events, school_ids, seed):
+        """Log in with the credentials of the benchmark's staff user."""
+        self.base_url = base_url.rstrip('/')
+        self.events = events
+        self.school_ids = school_ids
+        self.rng = random.Random(seed)
+        self.run_id = f'{seed}-{int(time.time())}'
+        self.session = requests.Session()
+        self.post(self.session, 'website:login', credentials)
+        if 'sessionid' not in self.session.cookies:
+            raise CommandError(f"Couldn't log in to {self.base_url}")
+
+    def url(self, name, **kwargs):
+        """Get the absolute URL of a route."""
+        return self.base_url + reverse(name, kwargs=kwargs or None)
+
+    def event_url(self, name):
+        """Get the URL of a route for a random event."""
+        slug, event_id = self.rng.choice(self.events)
+        return self.url(name, slug=slug, event_id=event_id)
+
+    def timed(self, send, expected_status):
+        """Send a request and time it."""
+        start = time.perf_counter()
+        try:
+            response = send()
+        except requests.RequestException:
+            return time.perf_counter() - start, 'exception', False
+        return (time.perf_counter() - start, response.status_code,
+                response.status_code == expected_status)
+
+    def post(self, session, name, data, url=None, expected_status=302):
+        """Get a form's CSRF token, then time posting the form."""
+        url = url or self.url(name)
+        session.get(url)
+        data = dict(data,
+                    csrfmiddlewaretoken=session.cookies.get('csrftoken', ''))
+        return self.timed(lambda: session.post(url, data=data,
+                                               headers={'Referer': url},
+                                               allow_redirects=False),
+                          expected_status)
+
+    def get(self, url, **params):
+        """Time a GET request as the logged in staff member."""
+        return self.timed(lambda: self.session.get(url, params=params,
+                                                   allow_redirects=False),
+                          200)
+
+    def index(self):  # noqa: D102
+        return self.get(self.url('website:index'))
+
+    def events_list(self):  # noqa: D102
+        return self.get(self.url('website:event_index'))
+
+    def event_page(self):  # noqa: D102
+        return self.get(self.event_url('website:event_page'))
+
+    def event_api(self):  # noqa: D102
+        return self.get(self.url('website:event_api'))
+
+    def school_search(self):  # noqa: D102
+        return self.get(self.url('website:school_search'),
+                        q=self.rng.choice(['syd', 'high', 'college', 'st']))
+
+    def assign_volunteers(self):  # noqa: D102
+        return self.get(self.event_url('website:assign_volunteers'))
+
+    def email_preview(self):  # noqa: D102
+        return self.get(self.event_url('website:volunteer_email_preview'))
+
+    def signup(self):  # noqa: D102
+        username = f'bench-{self.run_id}-{next(_signup_ids)}'
+        return self.post(requests.Session(), 'website:signup', {
+            'first_name': 'Bench',
+            'last_name': 'Student',
+            'email': f'{username}@example.com',
+            'username': username,
+            'password': 'correct-horse-battery',
+            'password2': 'correct-horse-battery',
+            'school': self.rng.choice(self.school_ids),
+            'email_consent': 'on',
+        })
+
+    def registration(self):  # noqa: D102
+        slug, event_id = self.rng.choice(self.events)
+        return self.post(self.session, 'website:registration', {
+            'event': event_id,
+            'name': 'Bench Student',
+            'email': 'bench@example.com',
+            'number': '0400000000',
+            'date_of_birth': '2006-01-01',
+            'parent_email': 'parent@example.com',
+            'parent_number': '0400000000',
+        }, url=self.url('website:registration', slug=slug, event_id=event_id))
+
+
+SCENARIOS = ('index', 'events_list', 'event_page', 'event_api',
+             'school_search', 'assign_volunteers', 'email_preview', 'signup',
+             'registration')
+
+
+def summarize(latencies, statuses, errors, seconds):
+    """
+    Summarize the results of a scenario.
+
+    Returns:
+        a dict of throughput, latency percentiles in milliseconds, error
+        rate and counts of each status code
+
+    """
+    n = len(latencies)
+    summary = {
+        'requests': n,
+        'errors': errors,
+        'error_rate': errors / n if n else 0,
+        'throughput': n / seconds,
+        # e.g. 500s from "database is locked"
+        'statuses': {str(status): count
+                     for status, count in sorted(statuses.items(), key=str)},
+    }
+    if n > 1:
+        percentiles = statistics.quantiles(latencies, n=100,
+                                           method='inclusive')
+        for p in (50, 95, 99):
+            summary[f'p{p}_ms'] = percentiles[p - 1] * 1000
+    return summary
+
+
+class Command(BaseCommand):
+    """
+    Management command for load testing a running server.
+
+    Run the server, e.g. gunicorn, against the same database as this command,
+    and generate data with load_dummy_data first. Each scenario is run for a
+    fixed time by a number of concurrent clients, logged in as a staff user
+    with a random password that is deleted when the run ends.
+    """
+
+    help = 'Load test every page of a running server and report latency'
+
+    def add_arguments(self, parser):
+        """Add arguments for the target server and the load."""
+        parser.add_argument(
+            '--url',
+            default='http://127.0.0.1:8000',
+            help='Base URL of the running server')
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help='Number of concurrent clients')
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=10,
+            help='Seconds to run each scenario for')
+        parser.add_argument(
+            '--scenario',
+            action='append',
+            choices=SCENARIOS,
+            dest='scenarios',
+            help='Scenario to run, can be repeated (default: all)')
+        parser.add_argument(
+            '--output',
+            help='Save the results as JSON to this file')
+        parser.add_argument(
+            '--allow-production',
+            action='store_true',
+            help='Run even though DEBUG is off. The benchmark creates a '
+                 'temporary superuser and fills the database with sign ups '
+                 'and registrations')
+
+    def get_data(self):
+        """Get the events and schools to use."""
+        events = list(Event.objects.filter(workshop__isnull=False)
+                      .distinct().values_list('slug', 'pk'))
+        school_ids = list(School.objects.filter(active=True)
+                          .values_list('pk', flat=True))
+        if not events or not school_ids:
+            raise CommandError('Load events with workshops and schools '
+                               'first, e.g. with load_dummy_data and '
+                               'load_schools')
+        return events, school_ids
+
+    def create_staff_user(self):
+        """Create a superuser with a random password for this run."""
+        credentials = {
+            'username': f'bench-staff-{secrets.token_hex(4)}',
+            'password': secrets.token_urlsafe(),
+        }
+        user = CustomUser.objects.create_superuser(
+            credentials['username'],
+            f'{credentials["username"]}@example.com',
+            credentials['password'])
+        return user, credentials
+
+    def run_scenario(self, clients, scenario, duration):
+        """Run a scenario on every client at once for a while."""
+        latencies, statuses, errors = [], Counter(), 0
+        lock = threading.Lock()
+        deadline = time.perf_counter() + duration
+
+        def run(client):
+            nonlocal errors
+            method = getattr(client, scenario)
+            while time.perf_counter() < deadline:
+                latency, status, ok = method()
+                with lock:
+                    latencies.append(latency)
+                    statuses[status] += 1
+                    errors += not ok
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(len(clients)) as executor:
+            list(executor.map(run, clients))
+        return summarize(latencies, statuses, errors,
+                         time.perf_counter() - start)
+
+    def handle(self, *args, **options):  # noqa: D102
+        if not settings.DEBUG and not options['allow_production']:
+            raise CommandError('DEBUG is off, so this may be a production '
+                               'database. Pass --allow-production to run '
+                               'anyway')
+        events, school_ids = self.get_data()
+        user, credentials = self.create_staff_user()
+        try:
+            self.run_benchmark(options, credentials, events, school_ids)
+        finally:
+            user.delete()
+
+    def run_benchmark(self, options, credentials, events, school_ids):
+        """Run every scenario and report the results."""
+        try:
+            clients = [BenchClient(options['url'], credentials, events,
+                                   school_ids, seed)
+                       for seed in range(options['concurrency'])]
+        except requests.RequestException as error:
+            raise CommandError(f"Couldn't reach {options['url']}: {error}")
+
+        results = {
+            'started_at': datetime.now().isoformat(),
+            'url': options['url'],
+            'concurrency': options['concurrency'],
+            'duration': options['duration'],
+            'settings': settings.SETTINGS_MODULE,
+            'scenarios': {},
+        }
+        self.stdout.write(f'{"scenario":<18} {"req/s":>8} {"p50 ms":>8} '
+                          f'{"p95 ms":>8} {"p99 ms":>8} {"errors":>7}')
+        for scenario in options['scenarios'] or SCENARIOS:
+            summary = self.run_scenario(clients, scenario,
+                                        options['duration'])
+            results['scenarios'][scenario] = summary
+            self.stdout.write(
+                f'{scenario:<18} {summary["throughput"]:>8.1f} '
+                f'{summary.get("p50_ms", 0):>8.1f} '
+                f'{summary.get("p95_ms", 0):>8.1f} '
+                f'{summary.get("p99_ms", 0):>8.1f} '
+                f'{summary["error_rate"]:>7.1%}')
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(
+                f'Saved results to {options["output"]}'))
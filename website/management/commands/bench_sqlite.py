@@ -0,0 +1,127 @@
+"""Management command to benchmark SQLite under concurrent workers."""
+
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+def connect(db_path, pragmas):
+    """Open a connection the way Django does and apply the pragmas."""
+    connection = sqlite3.connect(db_path)
+    for name, value in pragmas.items():
+        connection.execute(f'PRAGMA {name} = {value}')
+    return connection
+
+
+def run_worker(db_path, pragmas, seconds, write_ratio, seed):
+    """
+    Run a mix of reads and writes against the database for a while.
+
+    Reads count a page of rows like a listing page, writes insert a row in
+    their own transaction like a registration. Runs in a worker process.
+
+    Returns:
+        (reads, writes, locked errors)
+
+    """
+    rng = random.Random(seed)
+    connection = connect(db_path, pragmas)
+    reads = writes = errors = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        event_id = rng.randrange(100)
+        try:
+            if rng.random() < write_ratio:
+                with connection:
+                    connection.execute(
+                        'INSERT INTO bench (event_id, payload) VALUES (?, ?)',
+                        (event_id, 'x' * 200))
+                writes += 1
+            else:
+                connection.execute(
+                    'SELECT id, payload FROM bench WHERE event_id = ? '
+                    'ORDER BY id DESC LIMIT 20', (event_id,)).fetchall()
+                reads += 1
+        except sqlite3.OperationalError:
+            errors += 1
+    connection.close()
+    return reads, writes, errors
+
+
+class Command(BaseCommand):
+    """
+    Management command for benchmarking SQLite connection profiles.
+
+    Runs the same workload with default settings and with SQLITE_PRAGMAS,
+    on a scratch database so it is safe to run next to the live one.
+    """
+
+    help = 'Compare SQLite throughput with default and configured pragmas'
+
+    def add_arguments(self, parser):
+        """Add arguments to shape the workload."""
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=multiprocessing.cpu_count() * 2 + 1,
+            help='Number of concurrent processes (default: as gunicorn)')
+        parser.add_argument(
+            '--seconds',
+            type=float,
+            default=5,
+            help='How long to run each profile for')
+        parser.add_argument(
+            '--write-ratio',
+            type=float,
+            default=0.1,
+            help='Fraction of operations that are writes')
+        parser.add_argument(
+            '--dir',
+            help='Directory for the scratch database (default: system temp, '
+                 'use the data volume to measure its disk)')
+
+    def run_profile(self, name, pragmas, options):
+        """Run the workload on a fresh database and report throughput."""
+        with tempfile.TemporaryDirectory(dir=options['dir']) as tmp:
+            db_path = os.path.join(tmp, 'bench.sqlite3')
+            with connect(db_path, pragmas) as connection:
+                connection.execute(
+                    'CREATE TABLE bench (id INTEGER PRIMARY KEY, '
+                    'event_id INTEGER, payload TEXT)')
+                connection.execute(
+                    'CREATE INDEX bench_event_id ON bench (event_id)')
+                connection.executemany(
+                    'INSERT INTO bench (event_id, payload) VALUES (?, ?)',
+                    ((i % 100, 'x' * 200) for i in range(10000)))
+            connection.close()
+
+            args = [(db_path, pragmas, options['seconds'],
+                     options['write_ratio'], seed)
+                    for seed in range(options['workers'])]
+            with multiprocessing.Pool(options['workers']) as pool:
+                results = pool.starmap(run_worker, args)
+
+        reads, writes, errors = map(sum, zip(*results))
+        seconds = options['seconds']
+        self.stdout.write(
+            f'{name:<10} {reads / seconds:>10.0f} {writes / seconds:>10.0f} '
+            f'{errors:>8}')
+
+    def handle(self, *args, **options):  # noqa: D102
+        if not settings.SQLITE_PRAGMAS:
+            self.stderr.write(self.style.WARNING(
+                'SQLITE_PRAGMAS is empty, so both profiles are the same. '
+                'Try --settings=settings_prod'))
+        self.stdout.write(
+            f"{options['workers']} workers, {options['seconds']}s per "
+            f"profile, {options['write_ratio']:.0%} writes")
+        self.stdout.write(f'{"profile":<10} {"reads/s":>10} {"writes/s":>10} '
+                          f'{"locked":>8}')
+        self.run_profile('default', {}, options)
+        self.run_profile('tuned', settings.SQLITE_PRAGMAS, options)
@@ -0,0 +1,61 @@
+"""Management command to verify the prebuilt static bundle."""
+
+import json
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import (ManifestFilesMixin,
+                                                staticfiles_storage)
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """
+    Management command for verifying the static bundle.
+
+    The bundle is built when the Docker image is built, so starting the
+    container only needs to check that it is complete.
+    """
+
+    help = 'Verify the collected static files and offline compression manifest'
+
+    def check_staticfiles_manifest(self):
+        """Check every file in the staticfiles manifest exists."""
+        if not isinstance(staticfiles_storage, ManifestFilesMixin):
+            return 0
+        hashed_files = staticfiles_storage.load_manifest()
+        if not hashed_files:
+            raise CommandError(
+                f'{staticfiles_storage.manifest_name} is missing or empty, '
+                'run collectstatic')
+        # stylesheet sources are compiled by compress, then deleted
+        missing = [name for name in hashed_files.values()
+                   if not name.endswith('.scss')
+                   and not staticfiles_storage.exists(name)]
+        if missing:
+            raise CommandError(
+                f'{len(missing)} collected static files are missing, '
+                f'e.g. {missing[0]}')
+        return len(hashed_files)
+
+    def check_compress_manifest(self):
+        """Check the offline compression manifest exists."""
+        if not settings.COMPRESS_OFFLINE:
+            return 0
+        manifest_path = os.path.join(settings.COMPRESS_ROOT,
+                                     settings.COMPRESS_OUTPUT_DIR,
+                                     settings.COMPRESS_OFFLINE_MANIFEST)
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            raise CommandError(
+                f'{manifest_path} is missing or invalid, run compress')
+        return len(manifest)
+
+    def handle(self, *args, **options):  # noqa: D102
+        n_files = self.check_staticfiles_manifest()
+        n_blocks = self.check_compress_manifest()
+        self.stdout.write(self.style.SUCCESS(
+            f'Static bundle OK: {n_files} collected files, '
+            f'{n_blocks} compressed blocks'))
@@ -2,10 +2,56 @@
 
 from website.plugins import compressors
 from django.core.management.base import BaseCommand
+from PIL import Image
 
-import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from os import path
 
+VALID_IMAGE_EXTS = ('.png', '.jpeg', '.jpg')
+MANIFEST_NAME = '.compress_images.json'
+
+
+def file_hash(data):
+    """Get the content hash recorded in the manifest."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def compress_file(image):
+    """
+    Compress an image in place.
+
+    The compressed image is only written if it is smaller than the original.
+    Runs in a worker process.
+
+    Returns:
+        (path, original size, new size, seconds taken, hash of the new file)
+
+    Raises:
+        OSError, ValueError: the image couldn't be read or decoded
+
+    """
+    start = time.perf_counter()
+    with open(image, 'rb') as f:
+        original = f.read()
+    try:
+        compressed = compressors.compress_image(image, return_bytes=True)
+    except Image.DecompressionBombError as error:
+        # not an OSError or ValueError, so it would stop the whole run
+        raise ValueError(str(error)) from error
+    data = compressed.getvalue()
+    if len(data) < len(original):
+        with open(image, 'wb') as f:
+            f.write(data)
+    else:
+        data = original
+    return (image, len(original), len(data), time.perf_counter() - start,
+            file_hash(data))
+
 
 class Command(BaseCommand):
     """Management command for compressing collected static images."""
@@ -13,30 +59,108 @@ class Command(BaseCommand):
     help = 'Compress collected static images'
 
     def add_arguments(self, parser):
-        """Add argument to delete all exisiting data from the database."""
+        """Add arguments for the static directory and the worker pool."""
         parser.add_argument(
             'collected_static_dir',
             action='store',
             help='Location of the COLLECTED static files')
+        parser.add_argument(
+            '--manifest',
+            help='Location of the manifest of compressed files '
+                 f'(default: {MANIFEST_NAME} in the static directory)')
+        parser.add_argument(
+            '--jobs',
+            type=int,
+            help='Number of worker processes (default: number of CPUs)')
+        parser.add_argument(
+            '--cache',
+            help='Directory to keep compressed images in between runs. '
+                 'Images whose original is found in it are copied from it '
+                 'instead of being compressed again')
+
+    def find_images(self, static_dir, manifest):
+        """
+        Find images in the static directory that haven't been compressed.
+
+        Images whose content matches the hash recorded in the manifest were
+        already compressed by a previous run and are skipped.
+
+        Returns:
+            (list of (path, content hash) to compress, number of skipped
+            images)
+
+        """
+        images, skipped = [], 0
+        for root, _, files in os.walk(static_dir):
+            for name in files:
+                if not name.lower().endswith(VALID_IMAGE_EXTS):
+                    continue
+                image = path.join(root, name)
+                with open(image, 'rb') as f:
+                    digest = file_hash(f.read())
+                if manifest.get(path.relpath(image, static_dir)) == digest:
+                    skipped += 1
+                else:
+                    images.append((image, digest))
+        return images, skipped
 
     def handle(self, *args, **options):  # noqa: D102
         self.stdout.write('\nStarting image compression.')
 
         static_dir = path.abspath(options["collected_static_dir"])
-        valid_image_exts = ["png", "jpeg", "jpg"]
+        manifest_path = options['manifest'] or path.join(static_dir,
+                                                         MANIFEST_NAME)
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
 
-        for ext in valid_image_exts:
-            files = glob.glob(static_dir + f"/**/*.{ext}",
-                              recursive=True)
+        start = time.perf_counter()
+        images, skipped = self.find_images(static_dir, manifest)
+        self.stdout.write(f'Found {len(images)} new images, '
+                          f'skipping {skipped} already compressed')
 
-            self.stdout.write(f'Found {len(files)} .{ext} files')
-            for image in files:
-                self.stdout.write(f'Compressing {image}')
-                new_image = compressors.compress_image(
-                    image, return_bytes=True)
+        cache = options['cache']
+        if cache:
+            os.makedirs(cache, exist_ok=True)
+        saved = failed = restored = 0
+        with ProcessPoolExecutor(options['jobs']) as executor:
+            futures = {}
+            for image, original in images:
+                cached = cache and path.join(cache, original)
+                if cached and path.exists(cached):
+                    shutil.copyfile(cached, image)
+                    with open(image, 'rb') as f:
+                        manifest[path.relpath(image, static_dir)] = \
+                            file_hash(f.read())
+                    restored += 1
+                else:
+                    futures[executor.submit(compress_file, image)] = \
+                        (image, cached)
+            for future in as_completed(futures):
+                image, cached = futures[future]
+                name = path.relpath(image, static_dir)
+                try:
+                    _, before, after, seconds, digest = future.result()
+                except (OSError, ValueError,
+                        Image.DecompressionBombError) as error:
+                    failed += 1
+                    self.stderr.write(self.style.ERROR(
+                        f'Failed to compress {name}: {error}'))
+                    continue
+                if cached:
+                    shutil.copyfile(image, cached)
+                manifest[name] = digest
+                saved += before - after
+                self.stdout.write(f'Compressed {name}: {before} -> {after} '
+                                  f'bytes ({seconds:.2f}s)')
 
-                with open(image, "wb") as f:
-                    f.write(new_image.getbuffer())
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
 
-            self.stdout.write(self.style.SUCCESS(
-                f'Compressed {len(files)} .{ext} files'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Compressed {len(futures) - failed} images, restored {restored} '
+            f'from the cache, skipped {skipped}, failed {failed}. '
+            f'Saved {saved} bytes in '
+            f'{time.perf_counter() - start:.2f}s'))
@@ -1,10 +1,17 @@
 """Management command to load dummy data into database."""
+import random
 from datetime import date, datetime, time, timedelta
+from timeit import default_timer
 
 import pytz
+from django.contrib.auth.hashers import make_password
 from django.core.management.base import BaseCommand
 from django.db import transaction
-from website.models import Event, Workshop
+from django.utils.text import slugify
+from website.caching import bump_version
+from website.models import (CustomUser, Event, Position, Registration, School,
+                            Student, Volunteer, VolunteerAssignment, Workshop)
+from website.utils import recurrence_dates
 
 LOCAL_TZ = pytz.timezone('Australia/Sydney')
 
@@ -63,56 +70,191 @@ def make_event(name, days_from_now, n_week, workshop_time: time, location):
                      start_time=start_time.time(),
                      end_time=finish_time.time(),
                      location=location))
-    for workshop in workshops:
-        workshop.save()
+    Workshop.objects.bulk_create(workshops)
+    bump_version('page')
     return event
 
 
+def bulk_insert(model, objs):
+    """
+    Bulk create objects and make sure their primary keys are set.
+
+    Backends that can't return ids from a bulk insert, like SQLite, leave
+    them unset. Inside a transaction the new rows are the ones with the
+    highest ids, so they are read back in order.
+
+    Returns:
+        the created objects
+
+    """
+    objs = model.objects.bulk_create(objs)
+    if objs and objs[0].pk is None:
+        pks = model.objects.order_by('-pk') \
+            .values_list('pk', flat=True)[:len(objs)]
+        for obj, pk in zip(objs, reversed(list(pks))):
+            obj.pk = pk
+    return objs
+
+
 class Command(BaseCommand):
-    """Management command for loading dummy data."""
+    """
+    Management command for generating dummy data at scale.
+
+    All rows are built in memory from a seeded random generator and written
+    with bulk inserts, so the same arguments always produce the same data.
+    Dummy users have usernames starting with "dummy-" and the password
+    "dummy".
+    """
 
-    help = 'Load dummy event and workshop objects into database'
+    help = 'Generate dummy events, volunteers, students and registrations'
 
     def add_arguments(self, parser):
-        """Add argument to delete all exisiting data from the database."""
+        """Add arguments for the scale of the data and the seed."""
         parser.add_argument(
             '--clean',
             action='store_true',
             dest='clean',
-            help='Delete exisiting data before adding dummy data')
+            help='Delete existing events and dummy users before adding '
+                 'dummy data')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed for the random generator')
+        parser.add_argument('--events', type=int, default=10,
+                            help='Number of events')
+        parser.add_argument('--workshops', type=int, default=6,
+                            help='Number of weekly workshops per event')
+        parser.add_argument('--volunteers', type=int, default=30,
+                            help='Number of volunteers')
+        parser.add_argument('--availability', type=float, default=0.3,
+                            help='Chance a volunteer is available for a '
+                                 'workshop')
+        parser.add_argument('--assigned', type=float, default=0.5,
+                            help='Chance an available volunteer has an '
+                                 'assignment')
+        parser.add_argument('--students', type=int, default=100,
+                            help='Number of students')
+        parser.add_argument('--registrations', type=int, default=20,
+                            help='Number of registrations per event')
+
+    def make_users(self, kind, n):
+        """Bulk create n dummy users of a kind, e.g. "student"."""
+        return bulk_insert(CustomUser, (
+            CustomUser(username=f'dummy-{kind}-{i}',
+                       email=f'dummy-{kind}-{i}@example.com',
+                       first_name=kind.title(),
+                       last_name=str(i),
+                       password=self.password)
+            for i in range(n)))
+
+    def make_events(self, rng, options):
+        """Bulk create events and their weekly workshops."""
+        today = date.today()
+        events = []
+        for i in range(options['events']):
+            start = today + timedelta(days=rng.randint(-180, 180))
+            name = f'Dummy event {i + 1}'
+            events.append(Event(
+                name=name,
+                slug=slugify(name),
+                start_date=start,
+                finish_date=start + timedelta(
+                    weeks=max(options['workshops'] - 1, 0)),
+                description='Generated by load_dummy_data',
+                hidden_event=rng.random() < 0.2,
+                # bulk inserted registrations don't take their own seats
+                seats_taken=options['registrations']))
+        events = bulk_insert(Event, events)
+
+        workshops = bulk_insert(Workshop, (
+            Workshop(event_id=event.pk,
+                     name=f'Workshop #{n + 1}',
+                     date=workshop_date,
+                     start_time=time(16, 0),
+                     end_time=time(18, 0),
+                     location=rng.choice(['K17 oud lab', 'K17 lyre lab',
+                                          'K17 seminar room']))
+            for event in events
+            for n, workshop_date in enumerate(recurrence_dates(
+                event.start_date, interval=7, count=options['workshops']))))
+        return events, workshops
+
+    def make_volunteers(self, rng, workshops, options):
+        """Bulk create volunteers, their availability and assignments."""
+        positions = list(Position.objects.all()) or bulk_insert(
+            Position, [Position(name=name)
+                       for name in ('Mentor', 'Tutor', 'Head tutor')])
+        volunteers = bulk_insert(Volunteer, (
+            Volunteer(user_id=user.pk, position_id=rng.choice(positions).pk)
+            for user in self.make_users('volunteer', options['volunteers'])))
+
+        available = [(workshop.pk, volunteer.pk)
+                     for workshop in workshops
+                     for volunteer in volunteers
+                     if rng.random() < options['availability']]
+        Workshop.available.through.objects.bulk_create(
+            Workshop.available.through(workshop_id=workshop_id,
+                                       volunteer_id=volunteer_id)
+            for workshop_id, volunteer_id in available)
+
+        statuses = [status for status, _ in VolunteerAssignment.ASSIGN_CHOICES]
+        assignments = VolunteerAssignment.objects.bulk_create(
+            VolunteerAssignment(workshop_id=workshop_id,
+                                volunteer_id=volunteer_id,
+                                status=rng.choice(statuses))
+            for workshop_id, volunteer_id in available
+            if rng.random() < options['assigned'])
+        return volunteers, available, assignments
+
+    def make_students(self, rng, events, options):
+        """Bulk create students and registrations."""
+        schools = list(School.objects.filter(active=True)
+                       .values_list('pk', flat=True)) or [None]
+        students = Student.objects.bulk_create(
+            Student(user_id=user.pk,
+                    school_id=rng.choice(schools),
+                    email_consent=True)
+            for user in self.make_users('student', options['students']))
+
+        registrations = Registration.objects.bulk_create(
+            Registration(event_id=event.pk,
+                         name=f'Student {n + 1}',
+                         email=f'student{event.pk}.{n}@example.com',
+                         number=f'04{rng.randrange(10 ** 8):08}',
+                         date_of_birth=date(2005, 1, 1) + timedelta(
+                             days=rng.randrange(365 * 6)),
+                         parent_email=f'parent{event.pk}.{n}@example.com',
+                         parent_number=f'04{rng.randrange(10 ** 8):08}')
+            for event in events
+            for n in range(options['registrations']))
+        return students, registrations
 
     def handle(self, *args, **options):  # noqa: D102
+        rng = random.Random(options['seed'])
+        start = default_timer()
+        # hashing is slow, so every dummy user shares one hash
+        self.password = make_password('dummy')
         with transaction.atomic():
             if options['clean']:
                 Event.objects.all().delete()
-                Workshop.objects.all().delete()
-            make_event(
-                'Test: single-workshop event',
-                10,
-                1,
-                time(10, 0),  # 10:00 local time
-                'Learn how to <something> in 3 hours!',
-                'No prior programming experience required',
-                '3 hours?',
-                'UNSW K17 chi lab',
-            )
-
-            make_event(
-                'Intro to Programming',
-                15,
-                6,
-                time(16, 0),  # 16:00 local time
-                'Have you ever wanted to learn to write computer programs? '
-                'Jump in with the modern programming language Python and '
-                'learn to develop fun and exciting software from scratch.',
-                'No programming experience required',
-                '2 hours?',
-                'UNSW K17 oud lab')
-
-            make_event(
-                'Test: Advanced Web Development', 28, 7, time(16, 0),
-                'Learn how to make full-scale web apps with Django',
-                'Experience in web design (HTML,CSS,JavaScript) and coding in '
-                'Python', '2 hours', 'UNSW K17 lyre lab')
-
-        self.stdout.write(self.style.SUCCESS('Loaded.'))
+                CustomUser.objects.filter(username__startswith='dummy-') \
+                    .delete()
+            events, workshops = self.make_events(rng, options)
+            volunteers, available, assignments = self.make_volunteers(
+                rng, workshops, options)
+            students, registrations = self.make_students(rng, events,
+                                                         options)
+        bump_version('page')
+
+        counts = {
+            'events': events,
+            'workshops': workshops,
+            'volunteers': volunteers,
+            'available volunteers': available,
+            'assignments': assignments,
+            'students': students,
+            'registrations': registrations,
+        }
+        self.stdout.write(', '.join(f'{len(rows)} {name}'
+                                    for name, rows in counts.items()))
+        self.stdout.write(self.style.SUCCESS(
+            f'Loaded {sum(map(len, counts.values()))} rows in '
+            f'{default_timer() - start:.1f}s.'))
@@ -4,60 +4,162 @@ import csv
 from itertools import islice
 from os import path
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 
+from website.caching import bump_version
 from website.models import School
 
+# region codes used by the CSV, e.g. "QLD", mapped to School regions
+REGIONS = {code.split('_', 1)[1]: code
+           for code, _ in School.REGION_CHOICES if code.startswith('AU_')}
+
+
+def normalize_region(region):
+    """
+    Map a CSV region to a School region code.
+
+    Both the short state codes used by the CSV ("QLD") and School region
+    codes ("AU_QLD") are accepted.
+
+    Returns:
+        the region code, or None if the region is unknown
+
+    """
+    region = region.strip().upper()
+    if region in REGIONS.values() or region == 'OT_NUL':
+        return region
+    return REGIONS.get(region)
+
+
+def batches(iterable, size):
+    """Split an iterable into lists of at most size items."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
 
 class Command(BaseCommand):
-    """Management command for loading school data."""
+    """
+    Management command for loading school data.
+
+    Schools are matched to existing rows by name and region, so loading the
+    same list again changes nothing. Schools from an earlier import that are
+    missing from the list, and duplicates of listed schools, are deactivated
+    rather than deleted, so students keep their school. Schools added in the
+    admin, like "Home School", are left alone.
+
+    Each batch is written in its own transaction, so a long import doesn't
+    hold the database write lock throughout. If an import stops part way,
+    the schools already written are kept and nothing is deactivated, and
+    loading the CSV again finishes it.
+    """
 
     help = 'Load school data into database'
 
     def add_arguments(self, parser):
-        """Add argument to delete all exisiting data from the database."""
+        """Add arguments for the CSV and the batch size."""
         parser.add_argument(
             'csv_to_import',
             action='store',
             help='Location of the CSV to import')
         parser.add_argument(
-            '--clean',
+            '--keep-missing',
             action='store_true',
-            dest='clean',
-            help='Delete existing data before adding school data')
+            help="Don't deactivate imported schools that aren't in the CSV")
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of schools to write per query')
+
+    def read_schools(self, fp):
+        """
+        Stream (name, region) keys from the CSV.
+
+        Unknown regions are loaded as "Other - Unknown" with a warning.
+        """
+        for line, row in enumerate(csv.DictReader(fp, dialect='unix'), 2):
+            name = ' '.join(row['School Name'].split())
+            region = normalize_region(row['Region'])
+            if region is None:
+                self.stderr.write(self.style.WARNING(
+                    f'Line {line}: unknown region {row["Region"]!r} '
+                    f'for {name}'))
+                region = 'OT_NUL'
+            yield name, region
+
+    def diff(self, keys, existing, seen):
+        """
+        Compare part of the CSV against existing schools.
+
+        Args:
+            keys: iterable of (name, region) from the CSV
+            existing: dict of normalized (name, region) to lists of
+                existing Schools. Matched schools are removed from it.
+            seen: set of keys already read from the CSV, which is updated
+
+        Returns:
+            (Schools to insert, Schools to update)
+
+        """
+        inserts, updates = [], []
+        for key in keys:
+            if key in existing:
+                # extra rows with the same key are left to be deactivated
+                school = existing[key].pop(0)
+                if not existing[key]:
+                    del existing[key]
+                if (school.name, school.region, school.active,
+                        school.imported) != (*key, True, True):
+                    school.name, school.region = key
+                    school.active = school.imported = True
+                    updates.append(school)
+            elif key not in seen:
+                inserts.append(School(name=key[0], region=key[1],
+                                      imported=True))
+            seen.add(key)
+        return inserts, updates
 
     def handle(self, *args, **options):  # noqa: D102
-        schools = None
         filename = path.abspath(options["csv_to_import"])
+        batch_size = options['batch_size']
+
+        existing = {}
+        for school in School.objects.order_by('pk'):
+            key = (' '.join(school.name.split()),
+                   normalize_region(school.region) or school.region)
+            existing.setdefault(key, []).append(school)
 
+        seen = set()
+        n_inserts = n_updates = 0
+        try:
+            with open(filename, "r") as fp:
+                for keys in batches(self.read_schools(fp), batch_size):
+                    inserts, updates = self.diff(keys, existing, seen)
+                    with transaction.atomic():
+                        School.objects.bulk_create(inserts)
+                        School.objects.bulk_update(
+                            updates, ['name', 'region', 'active', 'imported'])
+                    n_inserts += len(inserts)
+                    n_updates += len(updates)
+        except FileNotFoundError:
+            raise CommandError(f"Couldn't open the file {filename}")
+
+        missing = []
+        if not options['keep_missing']:
+            missing = [school.pk
+                       for key, schools in existing.items()
+                       for school in schools
+                       if school.active and (school.imported or key in seen)]
         with transaction.atomic():
-            if options['clean']:
-                self.stdout.write(
-                    'Cleaning existing schools from the database')
-                School.objects.all().delete()
-            try:
-                with open(filename, "r") as fp:
-                    csvreader = list(csv.DictReader(fp, dialect='unix'))
-                    schools = (
-                        School(name=school["School Name"],
-                               region=school["Region"])
-                        for school in csvreader)
-            except FileNotFoundError as err:
-                self.stderr.write(self.style.ERROR(
-                    f"Couldn't open the file {filename}"))
-                raise err
-
-            batch_size = 100
-            number_complete = 0
-            while True:
-                school_objs = list(islice(schools, batch_size))
-                if not school_objs:
-                    break
-                School.objects.bulk_create(school_objs, batch_size)
-                number_complete += len(school_objs)
-                self.stdout.write(
-                    f'Loaded {number_complete} schools.')
-
-            self.stdout.write(self.style.SUCCESS(
-                f'Loaded all {number_complete} schools.'))
+            for batch in batches(missing, batch_size):
+                School.objects.filter(pk__in=batch).update(active=False)
+
+        bump_version('schools')
+        self.stdout.write(self.style.SUCCESS(
+            f'Loaded {len(seen)} schools: {n_inserts} added, '
+            f'{n_updates} updated, {len(missing)} deactivated.'))
@@ -0,0 +1,168 @@
+"""Management command to process uploaded images in the background."""
+
+import json
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from PIL import Image
+
+from website.caching import bump_version
+from website.models import Event, LightBox, ProcessedImageMixin
+from website.plugins import compressors
+from website.signals import bump_content_version
+
+IMAGE_MODELS = (Event, LightBox)
+
+
+def reclaim_abandoned_images():
+    """
+    Put images whose worker stopped while processing them back in the queue.
+
+    Returns:
+        the number of images reclaimed
+
+    """
+    abandoned_before = timezone.now() - timedelta(
+        seconds=settings.IMAGE_QUEUE_LEASE)
+    return sum(
+        model.objects
+        .filter(image_status=ProcessedImageMixin.PROCESSING,
+                image_claimed_at__lt=abandoned_before)
+        .update(image_status=ProcessedImageMixin.PENDING)
+        for model in IMAGE_MODELS)
+
+
+def claim_image():
+    """
+    Claim the next object whose image is waiting to be processed.
+
+    The status is changed with a conditional update, so only one worker can
+    claim an image even if several are running. Images left processing for
+    longer than IMAGE_QUEUE_LEASE are claimed again.
+
+    Returns:
+        the claimed Event or LightBox, or None if no image is pending
+
+    """
+    reclaim_abandoned_images()
+    for model in IMAGE_MODELS:
+        pending = model.objects \
+            .filter(image_status=ProcessedImageMixin.PENDING) \
+            .order_by('pk') \
+            .values_list('pk', flat=True)
+        for pk in pending[:10]:
+            if model.objects \
+                    .filter(pk=pk, image_status=ProcessedImageMixin.PENDING) \
+                    .update(image_status=ProcessedImageMixin.PROCESSING,
+                            image_claimed_at=timezone.now()):
+                return model.objects.get(pk=pk)
+    return None
+
+
+def save_renditions(image):
+    """
+    Resize an image and save its renditions next to it.
+
+    If saving a rendition fails, the ones already saved are deleted.
+
+    Returns:
+        list of {"name", "width", "type"} dicts, smallest first
+
+    """
+    root, _ = os.path.splitext(image.name)
+    with image.open('rb'):
+        renditions = compressors.make_renditions(
+            image, settings.IMAGE_RENDITION_WIDTHS)
+    saved = []
+    try:
+        for width, fmt, data in renditions:
+            saved.append({
+                'name': image.storage.save(f'{root}-{width}w.{fmt.lower()}',
+                                           ContentFile(data.getvalue())),
+                'width': width,
+                'type': compressors.RENDITION_TYPES[fmt],
+            })
+    except OSError:
+        for rendition in saved:
+            image.storage.delete(rendition['name'])
+        raise
+    return saved
+
+
+def process_image(obj):
+    """
+    Create the renditions of a claimed object's image and swap them in.
+
+    The largest rendition in the original format replaces the upload, so
+    plain links to the image keep working. The original upload is kept if it
+    is missing, can't be decoded or is too large to decode safely, or if a
+    new image was uploaded while this one was being processed.
+
+    Returns:
+        True if the renditions were swapped in
+
+    """
+    model = type(obj)
+    image = getattr(obj, obj.image_field)
+    # only touch the row if it still has the claimed image, as a new image
+    # may have been uploaded, and the claimed one deleted, since
+    claimed = model.objects.filter(
+        pk=obj.pk,
+        image_status=ProcessedImageMixin.PROCESSING,
+        **{obj.image_field: image.name})
+    try:
+        renditions = save_renditions(image)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        claimed.update(image_status=ProcessedImageMixin.FAILED)
+        return False
+
+    swapped = claimed.update(
+        image_status=ProcessedImageMixin.DONE,
+        renditions=json.dumps(renditions),
+        **{obj.image_field: renditions[-1]['name']})
+    if not swapped:
+        for rendition in renditions:
+            image.storage.delete(rendition['name'])
+        return False
+
+    image.storage.delete(image.name)
+    # update() doesn't send post_save, so invalidate cached pages here
+    bump_content_version(obj.pk if model is Event else obj.parent_id)
+    bump_version('page')
+    return True
+
+
+class Command(BaseCommand):
+    """Management command for compressing uploaded images."""
+
+    help = 'Create renditions of uploaded event images in the background'
+
+    def add_arguments(self, parser):
+        """Add arguments to control the worker loop."""
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Process all pending images and exit instead of polling')
+
+    def handle(self, *args, **options):  # noqa: D102
+        while True:
+            obj = claim_image()
+            if obj is None:
+                if options['once']:
+                    break
+                time.sleep(settings.IMAGE_QUEUE_POLL_INTERVAL)
+                continue
+
+            image = getattr(obj, obj.image_field)
+            self.stdout.write(f'Processing {image.name}')
+            if process_image(obj):
+                self.stdout.write(self.style.SUCCESS(
+                    f'Processed {image.name}'))
+            else:
+                self.stderr.write(self.style.ERROR(
+                    f'Kept original {image.name}'))
@@ -0,0 +1,168 @@
+"""Management command to deliver queued emails."""
+
+import time
+from datetime import timedelta
+from smtplib import SMTPException
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from django.utils import timezone
+
+from website.models import EmailJob, QueuedEmail
+
+
+def reclaim_abandoned_jobs():
+    """
+    Put jobs whose worker stopped while sending them back in the queue.
+
+    Workers renew their claim after every chunk, so a job that hasn't been
+    renewed for EMAIL_QUEUE_LEASE seconds was abandoned, e.g. by a crash.
+    This counts as a failed attempt.
+
+    Returns:
+        the number of jobs reclaimed
+
+    """
+    now = timezone.now()
+    abandoned = EmailJob.objects.filter(
+        status=EmailJob.SENDING,
+        claimed_at__lt=now - timedelta(seconds=settings.EMAIL_QUEUE_LEASE))
+    error = 'Worker stopped while sending'
+    failed = abandoned \
+        .filter(attempts__gte=settings.EMAIL_QUEUE_MAX_ATTEMPTS - 1) \
+        .update(status=EmailJob.FAILED, attempts=F('attempts') + 1,
+                last_error=error)
+    retried = abandoned.update(status=EmailJob.PENDING,
+                               attempts=F('attempts') + 1,
+                               next_attempt_at=now,
+                               last_error=error)
+    return failed + retried
+
+
+def claim_job():
+    """
+    Claim the next job that is due to be sent.
+
+    The status is changed with a conditional update, so only one worker can
+    claim a job even if several are running.
+
+    Returns:
+        the claimed EmailJob, or None if no job is due
+
+    """
+    reclaim_abandoned_jobs()
+    due = EmailJob.objects \
+        .filter(status=EmailJob.PENDING, next_attempt_at__lte=timezone.now()) \
+        .order_by('next_attempt_at') \
+        .values_list('pk', flat=True)
+    for pk in due[:10]:
+        if EmailJob.objects.filter(pk=pk, status=EmailJob.PENDING) \
+                .update(status=EmailJob.SENDING,
+                        claimed_at=timezone.now()):
+            return EmailJob.objects.get(pk=pk)
+    return None
+
+
+def send_chunk(connection, emails):
+    """
+    Send emails over an open connection.
+
+    Emails are marked sent even if a later one in the chunk fails, so a
+    retry doesn't send them twice.
+
+    Returns:
+        the number of emails sent
+
+    """
+    sent = []
+    try:
+        for email in emails:
+            EmailMessage(email.subject, email.body, email.from_email,
+                         [email.recipient], connection=connection).send()
+            sent.append(email.pk)
+    finally:
+        QueuedEmail.objects.filter(pk__in=sent).update(sent_at=timezone.now())
+        EmailJob.objects.filter(pk=emails[0].job_id).update(
+            sent=F('sent') + len(sent), claimed_at=timezone.now())
+    return len(sent)
+
+
+def deliver_job(job, chunk_size=None):
+    """
+    Send the unsent emails of a claimed job.
+
+    Emails are sent over one SMTP connection, and progress is saved after
+    every chunk. If sending fails
+    the job goes back to pending with an exponential backoff, until
+    EMAIL_QUEUE_MAX_ATTEMPTS is reached and it is marked failed. Invalid
+    emails, e.g. with a newline in a header, fail the job straight away.
+    """
+    chunk_size = chunk_size or settings.EMAIL_QUEUE_CHUNK_SIZE
+    unsent = job.emails.filter(sent_at__isnull=True).order_by('pk')
+    try:
+        with get_connection() as connection:
+            while True:
+                chunk = list(unsent[:chunk_size])
+                if not chunk:
+                    break
+                send_chunk(connection, chunk)
+    except ValueError as error:
+        # e.g. BadHeaderError, which retrying won't fix
+        EmailJob.objects.filter(pk=job.pk).update(
+            status=EmailJob.FAILED, attempts=F('attempts') + 1,
+            last_error=str(error))
+        return False
+    except (SMTPException, OSError) as error:
+        job.refresh_from_db()
+        job.attempts += 1
+        job.last_error = str(error)
+        if job.attempts >= settings.EMAIL_QUEUE_MAX_ATTEMPTS:
+            job.status = EmailJob.FAILED
+        else:
+            job.status = EmailJob.PENDING
+            job.next_attempt_at = timezone.now() + timedelta(
+                seconds=settings.EMAIL_QUEUE_RETRY_DELAY
+                * 2 ** (job.attempts - 1))
+        job.save(update_fields=['attempts', 'last_error', 'status',
+                                'next_attempt_at'])
+        return False
+
+    EmailJob.objects.filter(pk=job.pk).update(status=EmailJob.SENT)
+    return True
+
+
+class Command(BaseCommand):
+    """Management command for delivering queued emails."""
+
+    help = 'Send queued emails, retrying failed jobs with backoff'
+
+    def add_arguments(self, parser):
+        """Add arguments to control the worker loop."""
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Send all jobs that are due and exit instead of polling')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            help='Number of emails to send between progress updates')
+
+    def handle(self, *args, **options):  # noqa: D102
+        while True:
+            job = claim_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(settings.EMAIL_QUEUE_POLL_INTERVAL)
+                continue
+
+            self.stdout.write(f'Sending job {job.pk} ({job.total} emails)')
+            if deliver_job(job, options['chunk_size']):
+                self.stdout.write(self.style.SUCCESS(f'Sent job {job.pk}'))
+            else:
+                job.refresh_from_db()
+                self.stderr.write(self.style.ERROR(
+                    f'Job {job.pk} failed (attempt {job.attempts}): '
+                    f'{job.last_error}'))
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-16 19:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0001_squashed_0022_auto_20200630_1343'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='content_version',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Incremented whenever the event or its content changes. Used to key cached content.'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.14 on 2026-10-16 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0004_email_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='image_status',
+            field=models.CharField(choices=[('PE', 'Pending'), ('PR', 'Processing'), ('DO', 'Done'), ('FA', 'Failed')], default='DO', editable=False, max_length=2),
+        ),
+        migrations.AddField(
+            model_name='lightbox',
+            name='image_status',
+            field=models.CharField(choices=[('PE', 'Pending'), ('PR', 'Processing'), ('DO', 'Done'), ('FA', 'Failed')], default='DO', editable=False, max_length=2),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.14 on 2026-10-16 19:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0005_image_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='renditions',
+            field=models.TextField(default='[]', editable=False),
+        ),
+        migrations.AddField(
+            model_name='lightbox',
+            name='renditions',
+            field=models.TextField(default='[]', editable=False),
+        ),
+    ]
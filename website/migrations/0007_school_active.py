@@ -0,0 +1,28 @@
+# Generated by Django 3.0.14 on 2026-10-16 19:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0006_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='school',
+            name='active',
+            field=models.BooleanField(default=True, help_text="Inactive schools are kept for existing students but can't be chosen when signing up."),
+        ),
+        migrations.AlterField(
+            model_name='school',
+            name='name',
+            field=models.CharField(max_length=100, verbose_name='school name'),
+        ),
+        migrations.AlterField(
+            model_name='school',
+            name='region',
+            field=models.CharField(choices=[('AU_QLD', 'Queensland'), ('AU_NSW', 'New South Wales'), ('AU_SA', 'South Australia'), ('AU_NT', 'Northern Territory'), ('AU_VIC', 'Victoria'), ('AU_WA', 'Western Australia'), ('AU_TAS', 'Tasmania'), ('AU_ACT', 'Australian Capital Territory'), ('OT_NUL', 'Other - Unknown')], default='OT_NUL', max_length=6, verbose_name='wider govermental region'),
+        ),
+    ]
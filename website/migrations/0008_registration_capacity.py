@@ -0,0 +1,58 @@
+# Generated by Django 3.0.14 on 2026-10-16 19:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models.functions import Coalesce
+
+
+def count_seats_taken(apps, schema_editor):
+    """Count the seats taken by existing registrations."""
+    Event = apps.get_model('website', 'Event')
+    Registration = apps.get_model('website', 'Registration')
+    Event.objects.update(seats_taken=Coalesce(models.Subquery(
+        Registration.objects
+        .filter(event=models.OuterRef('pk'))
+        .values('event')
+        .annotate(n=models.Count('pk'))
+        .values('n')[:1]), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0007_school_active'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='capacity',
+            field=models.PositiveIntegerField(blank=True, help_text='Leave blank for unlimited seats. Students who register once it is full are waitlisted.', null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='seats_taken',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='registration',
+            name='status',
+            field=models.CharField(choices=[('CO', 'Confirmed'), ('WL', 'Waitlist')], default='CO', editable=False, max_length=2),
+        ),
+        migrations.AddField(
+            model_name='registration',
+            name='workshop',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='registrations', to='website.Workshop'),
+        ),
+        migrations.AddField(
+            model_name='workshop',
+            name='capacity',
+            field=models.PositiveIntegerField(blank=True, help_text='Leave blank for unlimited seats. Students who register once it is full are waitlisted.', null=True),
+        ),
+        migrations.AddField(
+            model_name='workshop',
+            name='seats_taken',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_seats_taken, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-16 19:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0008_registration_capacity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailjob',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
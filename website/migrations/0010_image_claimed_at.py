@@ -0,0 +1,23 @@
+# Generated by Django 3.0.14 on 2026-10-16 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0009_emailjob_claimed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='image_claimed_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='lightbox',
+            name='image_claimed_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-16 19:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0010_image_claimed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='school',
+            name='imported',
+            field=models.BooleanField(default=False, editable=False, help_text='Loaded by load_schools, which deactivates imported schools missing from a later import.'),
+        ),
+    ]
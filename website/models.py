@@ -1,13 +1,17 @@
 """Provides models for the CompClub website."""
+import json
+from datetime import date
+
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q
 from django.forms import ValidationError
+from django.utils import timezone
 from django.utils.text import slugify
 
 from content_editor.models import Region, create_plugin_base
 from ckeditor.fields import RichTextField
-from website.plugins import compressors
 
 
 class CustomUser(AbstractUser):
@@ -63,14 +67,22 @@ class School(models.Model):
         ('AU_VIC', 'Victoria'),
         ('AU_WA', 'Western Australia'),
         ('AU_TAS', 'Tasmania'),
+        ('AU_ACT', 'Australian Capital Territory'),
         ('OT_NUL', 'Other - Unknown')
     )
 
-    name = models.CharField(verbose_name='school name', max_length=50)
+    name = models.CharField(verbose_name='school name', max_length=100)
     region = models.CharField(verbose_name='wider govermental region',
                               max_length=6,
                               choices=REGION_CHOICES,
                               default="OT_NUL")
+    active = models.BooleanField(
+        default=True,
+        help_text="Inactive schools are kept for existing students but can't be chosen when signing up.")  # noqa: E501
+    imported = models.BooleanField(
+        default=False,
+        editable=False,
+        help_text="Loaded by load_schools, which deactivates imported schools missing from a later import.")  # noqa: E501
 
     def __str__(self):
         """Return a string representation of a school."""
@@ -92,7 +104,258 @@ class Student(models.Model):
         )
 
 
-class Event(models.Model):
+class EventQuerySet(models.QuerySet):
+    """Event queries that apply the visibility rules in SQL."""
+
+    def visible_to(self, user):
+        """
+        Events the user may see in listings.
+
+        Hidden events require the view_hidden_event permission.
+        """
+        if user.has_perm('website.view_hidden_event'):
+            return self.all()
+        return self.filter(hidden_event=False)
+
+    def released_to(self, user):
+        """
+        Events whose page the user may open.
+
+        On top of the visible_to rules, events that are unreleased or haven't
+        started yet require the view_unreleased_event permission.
+        """
+        events = self.visible_to(user)
+        if user.has_perm('website.view_unreleased_event'):
+            return events
+        return events.filter(released=True, start_date__lte=date.today())
+
+    def current(self):
+        """Events that haven't finished yet."""
+        return self.filter(finish_date__gte=date.today())
+
+
+class PartialSaveMixin(models.Model):
+    """
+    Mixin for models with fields that saving an existing row leaves alone.
+
+    Fields changed by F() or conditional updates, like counters, would be
+    rolled back by saving an instance that was loaded before the update.
+    """
+
+    class Meta:   # noqa: D106
+        abstract = True
+
+    def get_unsaved_fields(self):
+        """Get the names of fields that saving an existing row skips."""
+        return set()
+
+    def save(self, *args, **kwargs):
+        """Save every field except the unsaved fields of an existing row."""
+        unsaved = self.get_unsaved_fields()
+        if unsaved and not self._state.adding \
+                and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in unsaved]
+        super().save(*args, **kwargs)
+
+
+class ProcessedImageMixin(PartialSaveMixin):
+    """
+    Mixin for models with an image that is compressed in the background.
+
+    Uploads are stored as-is and marked pending. The process_images
+    management command resizes them into renditions of several widths, in
+    WebP and the original format, and swaps in the largest fallback.
+    """
+
+    PENDING = 'PE'
+    PROCESSING = 'PR'
+    DONE = 'DO'
+    FAILED = 'FA'
+    IMAGE_STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    image_status = models.CharField(max_length=2,
+                                    choices=IMAGE_STATUS_CHOICES,
+                                    default=DONE,
+                                    editable=False)
+    # JSON list of {"name", "width", "type"} objects, smallest first
+    renditions = models.TextField(default='[]', editable=False)
+    # when a worker claimed the image, to reclaim it if the worker stops
+    image_claimed_at = models.DateTimeField(null=True, editable=False)
+
+    # name of the ImageField to process
+    image_field = None
+
+    class Meta:   # noqa: D106
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):  # noqa: D102
+        instance = super().from_db(db, field_names, values)
+        instance._saved_image = dict(zip(field_names, values)).get(
+            cls.image_field)
+        return instance
+
+    def get_unsaved_fields(self):
+        """
+        Don't write back an image that hasn't changed.
+
+        The worker may have swapped in a rendition and deleted the original
+        since the row was loaded.
+        """
+        unsaved = super().get_unsaved_fields()
+        image = getattr(self, self.image_field)
+        if image._committed and \
+                image.name == getattr(self, '_saved_image', None):
+            unsaved |= {self.image_field, 'image_status', 'renditions',
+                        'image_claimed_at'}
+        return unsaved
+
+    def save(self, *args, **kwargs):
+        """
+        Mark newly uploaded images for processing.
+
+        The image being replaced and its renditions are deleted, whether or
+        not it was processed.
+        """
+        image = getattr(self, self.image_field)
+        old_image, old_renditions = None, '[]'
+        if image and not image._committed:
+            if not self._state.adding:
+                old_image, old_renditions = type(self).objects \
+                    .filter(pk=self.pk) \
+                    .values_list(self.image_field, 'renditions') \
+                    .first() or (None, '[]')
+            self.image_status = self.PENDING
+            self.renditions = '[]'
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'],
+                                           'image_status', 'renditions'}
+        super().save(*args, **kwargs)
+        self._saved_image = image.name
+
+        def delete_old_image():
+            # an unprocessed upload isn't one of the renditions
+            names = {rendition['name']
+                     for rendition in json.loads(old_renditions)}
+            if old_image:
+                names.add(old_image)
+            names.discard(image.name)
+            for name in names:
+                image.storage.delete(name)
+
+        transaction.on_commit(delete_old_image)
+
+    def get_srcset(self, mime_type):
+        """
+        Get a srcset attribute value for the renditions of a format.
+
+        Returns:
+            the srcset, or an empty string if there are no renditions
+
+        """
+        storage = getattr(self, self.image_field).storage
+        return ', '.join(
+            f'{storage.url(rendition["name"])} {rendition["width"]}w'
+            for rendition in json.loads(self.renditions)
+            if rendition['type'] == mime_type)
+
+    @property
+    def webp_srcset(self):
+        """Get the srcset of the WebP renditions."""
+        return self.get_srcset('image/webp')
+
+    @property
+    def fallback_srcset(self):
+        """Get the srcset of the renditions in the original format."""
+        fallback = {rendition['type']
+                    for rendition in json.loads(self.renditions)}
+        fallback.discard('image/webp')
+        return self.get_srcset(fallback.pop()) if fallback else ''
+
+
+class CapacityMixin(PartialSaveMixin):
+    """
+    Mixin for models with a limited number of seats.
+
+    Seats are counted in `seats_taken` rather than by counting registrations,
+    so a seat can be taken with a single conditional UPDATE.
+    """
+
+    capacity = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Leave blank for unlimited seats. Students who register once it is full are waitlisted.")  # noqa: E501
+    seats_taken = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:   # noqa: D106
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):  # noqa: D102
+        instance = super().from_db(db, field_names, values)
+        instance._saved_capacity = dict(zip(field_names, values)).get(
+            'capacity')
+        return instance
+
+    def get_unsaved_fields(self):
+        """Don't overwrite seats taken since the row was loaded."""
+        return super().get_unsaved_fields() | {'seats_taken'}
+
+    def save(self, *args, **kwargs):  # noqa: D102
+        super().save(*args, **kwargs)
+        self._saved_capacity = self.capacity
+
+    @property
+    def capacity_increased(self):
+        """
+        Check if seats were added since the row was loaded or last saved.
+
+        Rows that weren't loaded are assumed to have changed.
+        """
+        if not hasattr(self, '_saved_capacity'):
+            return True
+        if self._saved_capacity is None:
+            return False
+        return self.capacity is None or self.capacity > self._saved_capacity
+
+    @property
+    def seats_left(self):
+        """Get the number of seats left, or None if there is no limit."""
+        if self.capacity is None:
+            return None
+        return max(self.capacity - self.seats_taken, 0)
+
+    @classmethod
+    def take_seat(cls, pk):
+        """
+        Take a seat if there is one left.
+
+        The check and the increment are one UPDATE, so concurrent
+        registrations can't both take the last seat.
+
+        Returns:
+            whether a seat was taken
+
+        """
+        return cls.objects.filter(
+            Q(capacity__isnull=True) | Q(seats_taken__lt=F('capacity')),
+            pk=pk,
+        ).update(seats_taken=F('seats_taken') + 1) == 1
+
+    @classmethod
+    def release_seat(cls, pk):
+        """Give a seat back."""
+        cls.objects.filter(pk=pk, seats_taken__gt=0) \
+            .update(seats_taken=F('seats_taken') - 1)
+
+
+class Event(ProcessedImageMixin, CapacityMixin, models.Model):
     """Model representing a CompClub event."""
 
     name = models.CharField(max_length=100)
@@ -121,6 +384,15 @@ class Event(models.Model):
         default=True,
         help_text="Leave this checked if you want to automatically release the event on the start date (at midnight).",  # noqa: E501
     )
+    content_version = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Incremented whenever the event or its content changes. Used to key cached content.")  # noqa: E501
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = EventQuerySet.as_manager()
+
+    image_field = 'display_image'
 
     regions = [
         Region(key='main', title='main region')
@@ -147,18 +419,23 @@ class Event(models.Model):
             raise ValidationError(
                 'You must provide a display image if highlighting the event.')
 
+    def get_unsaved_fields(self):
+        """Don't roll back content versions bumped since the row was loaded."""
+        return super().get_unsaved_fields() | {'content_version'}
+
     def save(self, *args, **kwargs):
         """Override save to update slug."""
         self.slug = slugify(self.name)
-        if self.display_image and str(
-                self.display_image.path) != str(
-                self.display_image.file):
-            self.display_image = compressors.compress_image(self.display_image)
-
         super(Event, self).save(*args, **kwargs)
 
 
-EventPlugin = create_plugin_base(Event)
+class EventPlugin(create_plugin_base(Event)):
+    """Base model for the content-editor plugins of an event."""
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:   # noqa: D106
+        abstract = True
 
 
 class RichText(EventPlugin):
@@ -199,7 +476,7 @@ class NoEmbed(EventPlugin):
         verbose_name_plural = 'embeds'
 
 
-class LightBox(EventPlugin):
+class LightBox(ProcessedImageMixin, EventPlugin):
     """Represents a LightBox field."""
 
     file = models.ImageField(upload_to='uploads/%Y/%m/',
@@ -212,13 +489,10 @@ class LightBox(EventPlugin):
         verbose_name = 'image'
         verbose_name_plural = 'images'
 
-    def save(self, *args, **kwargs):  # noqa: D102
-        if str(self.file.path) != str(self.file.file):
-            self.file = compressors.compress_image(self.file)
-        super().save(*args, **kwargs)
+    image_field = 'file'
 
 
-class Workshop(models.Model):
+class Workshop(CapacityMixin, models.Model):
     """Model representing a workshop in a CompClub event."""
 
     event = models.ForeignKey(Event,
@@ -235,23 +509,31 @@ class Workshop(models.Model):
     assigned = models.ManyToManyField(Volunteer,
                                       through='VolunteerAssignment',
                                       related_name='workshops_assigned')
+    updated_at = models.DateTimeField(auto_now=True)
 
     def unassigned(self):
-        """Get list of available volunteers who are not yet assigned."""
-        return list(self.available.exclude(id__in=self.assigned.all()))
+        """
+        Get list of available volunteers who are not yet assigned.
+
+        Uses prefetched `available` and `assignment` relations if present.
+        """
+        assigned = {a.volunteer_id for a in self.assignment.all()}
+        return [v for v in self.available.all() if v.id not in assigned]
 
     def withdrawn(self):
         """
         Return a list of volunteers who withdrew.
 
         'Withdraw' means those who were assigned or on waitlist but then
-        withdrew their availability.
+        withdrew their availability. Uses prefetched `available` and
+        `assignment` relations if present.
         """
-        assignments = list(
-            self.assignment.exclude(
-                status=VolunteerAssignment.DECLINED).exclude(
-                    volunteer__in=self.available.all()))
-        return list(map(lambda assign: assign.volunteer, assignments))
+        available = {v.id for v in self.available.all()}
+        return [
+            assignment.volunteer for assignment in self.assignment.all()
+            if assignment.status != VolunteerAssignment.DECLINED
+            and assignment.volunteer_id not in available
+        ]
 
     def __str__(self):
         """Return a string representation of a workshop."""
@@ -293,9 +575,31 @@ class VolunteerAssignment(models.Model):
 
 
 class Registration(models.Model):
-    """Model representing a student registration."""
+    """
+    Model representing a student registration.
+
+    A new registration takes a seat at its event, and at its workshop if it
+    has one. If either is full, it is waitlisted instead, and confirmed when
+    a seat is given back.
+    """
+
+    CONFIRMED = 'CO'
+    WAITLIST = 'WL'
+    STATUS_CHOICES = (
+        (CONFIRMED, 'Confirmed'),
+        (WAITLIST, 'Waitlist'),
+    )
 
     event = models.ForeignKey(Event, on_delete=models.CASCADE)
+    workshop = models.ForeignKey(Workshop,
+                                 on_delete=models.SET_NULL,
+                                 null=True,
+                                 blank=True,
+                                 related_name='registrations')
+    status = models.CharField(max_length=2,
+                              choices=STATUS_CHOICES,
+                              default=CONFIRMED,
+                              editable=False)
     name = models.CharField(max_length=100)
     email = models.EmailField(verbose_name='email address')
     number = models.CharField(verbose_name='phone number', max_length=15)
@@ -307,3 +611,159 @@ class Registration(models.Model):
     def __str__(self):
         """Return a string representation of a registration."""
         return f"{self.name}"
+
+    def clean(self):
+        """Check the workshop, if any, is part of the event."""
+        if self.workshop_id is not None \
+                and self.workshop.event_id != self.event_id:
+            raise ValidationError('The workshop is not part of the event.')
+
+    def save(self, *args, **kwargs):
+        """Take a seat for a new registration, or waitlist it."""
+        if self._state.adding:
+            with transaction.atomic():
+                # a write first, so SQLite takes the write lock up front
+                self.status = (self.CONFIRMED if self.take_seats()
+                               else self.WAITLIST)
+                super().save(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
+
+    def take_seats(self):
+        """
+        Take a seat at the event, and at the workshop if there is one.
+
+        Returns:
+            whether the seats were taken. If either is full, neither is.
+
+        """
+        with transaction.atomic():
+            if Event.take_seat(self.event_id) and (
+                    self.workshop_id is None
+                    or Workshop.take_seat(self.workshop_id)):
+                return True
+            transaction.set_rollback(True)
+            return False
+
+    def release_seats(self):
+        """Give back the seats of a confirmed registration."""
+        Event.release_seat(self.event_id)
+        if self.workshop_id is not None:
+            Workshop.release_seat(self.workshop_id)
+
+    def confirm(self):
+        """
+        Confirm a waitlisted registration if there are seats for it.
+
+        Returns:
+            whether the registration was confirmed
+
+        """
+        with transaction.atomic():
+            if self.take_seats() and Registration.objects.filter(
+                    pk=self.pk, status=self.WAITLIST) \
+                    .update(status=self.CONFIRMED):
+                self.status = self.CONFIRMED
+                return True
+            transaction.set_rollback(True)
+            return False
+
+    @classmethod
+    def promote_waitlist(cls, event_id, limit=None):
+        """
+        Confirm waitlisted registrations for an event, oldest first.
+
+        Registrations for a workshop that is still full are skipped. Stops
+        once the event is full.
+
+        Args:
+            event_id: the ID of the event
+            limit: the most registrations to confirm, or None for as many
+                as there are seats for
+
+        Returns:
+            the number of registrations confirmed
+
+        """
+        confirmed = 0
+        # read the waitlist up front rather than holding a cursor open on it
+        # while confirming
+        waitlist = list(cls.objects
+                        .filter(event_id=event_id, status=cls.WAITLIST)
+                        .order_by('pk'))
+        for registration in waitlist:
+            if limit is not None and confirmed >= limit:
+                break
+            if registration.confirm():
+                confirmed += 1
+            elif Event.objects.filter(pk=event_id,
+                                      seats_taken__gte=F('capacity')) \
+                    .exists():
+                break
+        return confirmed
+
+
+class EmailJob(models.Model):
+    """
+    Model representing a batch of queued emails.
+
+    Jobs are delivered in the background by the send_queued_email management
+    command, so that sending doesn't block a web worker.
+    """
+
+    PENDING = 'PE'
+    SENDING = 'SE'
+    SENT = 'ST'
+    FAILED = 'FA'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+
+    event = models.ForeignKey(Event,
+                              on_delete=models.SET_NULL,
+                              null=True,
+                              related_name='email_jobs')
+    created_by = models.ForeignKey(CustomUser,
+                                   on_delete=models.SET_NULL,
+                                   null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(max_length=2,
+                              choices=STATUS_CHOICES,
+                              default=PENDING)
+    total = models.PositiveIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    # renewed by the sending worker after each chunk
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:  # noqa: D106
+        ordering = ['-created_at']
+
+    def __str__(self):  # noqa: D105
+        return f'{self.get_status_display()}: {self.sent}/{self.total} sent'
+
+    @property
+    def progress(self):
+        """Return the percentage of emails sent."""
+        return 100 * self.sent // self.total if self.total else 100
+
+
+class QueuedEmail(models.Model):
+    """Model representing a single email in an EmailJob."""
+
+    job = models.ForeignKey(EmailJob,
+                            on_delete=models.CASCADE,
+                            related_name='emails')
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.EmailField()
+    recipient = models.EmailField()
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):  # noqa: D105
+        return f'{self.subject} ({self.recipient})'
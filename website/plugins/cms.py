@@ -1,8 +1,24 @@
 """A collection of renderers for the django-content-editor."""
 
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
 from django.utils.html import format_html, mark_safe
 import requests
 
+from website.instrumentation import timed
+
+logger = logging.getLogger(__name__)
+
+NOEMBED_URL = "https://noembed.com/embed"
+
 
 def render_rich_text(element):
     """Render a rich text element."""
@@ -24,33 +40,151 @@ def render_download(element):
     )  # noqa: E501
 
 
+def fetch_noembed(url):
+    """
+    Fetch the embed HTML for a URL from noembed.com.
+
+    Raises:
+        requests.RequestException: the provider could not be reached
+        ValueError, KeyError: the provider returned an error instead of HTML
+
+    """
+    with timed("http"):
+        response = requests.get(NOEMBED_URL,
+                                params={"url": url},
+                                timeout=settings.NOEMBED_TIMEOUT)
+    response.raise_for_status()
+    return response.json()["html"].strip()
+
+
+def _noembed_cache_key(url):
+    """Return a cache key for an embed URL that is safe for any backend."""
+    return "noembed:" + hashlib.sha1(url.encode()).hexdigest()
+
+
+def refresh_noembed(url):
+    """
+    Fetch an embed and store it in the NoEmbed cache.
+
+    Entries are kept for NOEMBED_STALE_TTL so that the last good HTML can
+    still be served while the provider is slow or down.
+
+    Returns:
+        the embed HTML, or None if the lookup failed
+
+    """
+    cache = caches[settings.NOEMBED_CACHE_ALIAS]
+    key = _noembed_cache_key(url)
+    try:
+        html = fetch_noembed(url)
+    except (requests.RequestException, ValueError, KeyError):
+        logger.warning("NoEmbed lookup failed for %s", url, exc_info=True)
+        return None
+
+    cache.set(key, (html, time.time()), settings.NOEMBED_STALE_TTL)
+    return html
+
+
+def _revalidate_noembed(url):
+    """Refresh a stale embed without blocking the current request."""
+    threading.Thread(target=refresh_noembed, args=(url,), daemon=True).start()
+
+
+def get_noembed_html(url):
+    """
+    Return the embed HTML for a URL, going to noembed.com only when needed.
+
+    Entries younger than NOEMBED_TTL are served from the cache. Older entries
+    are still served, but are refreshed in the background
+    (stale-while-revalidate). Only a URL that has never been cached is looked
+    up inline.
+
+    A lock entry limits every worker to one lookup per URL per
+    NOEMBED_RETRY_DELAY, so a failing provider isn't hammered on every view.
+
+    Returns:
+        the embed HTML, or None if there is no cached copy and the lookup
+        failed
+
+    """
+    cache = caches[settings.NOEMBED_CACHE_ALIAS]
+    key = _noembed_cache_key(url)
+    entry = cache.get(key)
+    should_fetch = (entry is None
+                    or time.time() - entry[1] > settings.NOEMBED_TTL)
+    if should_fetch and not cache.add(key + ":lock", True,
+                                      settings.NOEMBED_RETRY_DELAY):
+        should_fetch = False
+
+    if entry is None:
+        return refresh_noembed(url) if should_fetch else None
+
+    if should_fetch:
+        _revalidate_noembed(url)
+    return entry[0]
+
+
+def prefetch_noembeds(urls):
+    """
+    Look up every uncached embed at once.
+
+    Rendering looks embeds up one at a time, so a page with several new
+    embeds would wait for each in turn. Fetching them in parallel first means
+    it only waits for the slowest.
+    """
+    cache = caches[settings.NOEMBED_CACHE_ALIAS]
+    keys = {_noembed_cache_key(url): url for url in urls}
+    missing = keys.keys() - cache.get_many(keys).keys()
+    if len(missing) < 2:
+        return
+    with ThreadPoolExecutor(min(len(missing), 8)) as executor:
+        # run each lookup in a copy of this context so it is timed as part of
+        # the request
+        futures = [executor.submit(copy_context().run, get_noembed_html,
+                                   keys[key]) for key in missing]
+        for future in futures:
+            future.result()
+
+
 def render_noembed(element):
     """Render a NoEmbed element.
 
     This is NOT safe for use with non-admin/staff user input.
-    """
-    response = requests.get("https://noembed.com/embed", params={
-        "url": element.url
-    })
 
-    noembed_html = response.json()["html"].strip()
+    Returns:
+        the rendered HTML, and whether a plain link was rendered because the
+        embed could not be looked up
+
+    """
+    noembed_html = get_noembed_html(element.url)
+    fallback = noembed_html is None
+    if fallback:
+        # Provider is down and we have nothing cached; link to the content
+        # rather than failing the whole page.
+        noembed_html = format_html('<a href="{0}">{0}</a>', element.url)
 
     return mark_safe(
         str.format("""
         <figure class="embed-container">{}<figcaption>{}</figcaption></figure>
         """, noembed_html, element.caption)
-    )
+    ), fallback
 
 
 def render_lightbox(element):
-    """Render an image with a lightbox."""
-    return mark_safe(
-        str.format("""
-        <a data-fslightbox href="{0}">
+    """Render an image with a lightbox, using its renditions if it has any."""
+    picture = render_to_string('website/components/picture.html', {
+        'picture': element,
+        'image': element.file,
+        'sizes': '(min-width: 1200px) 684px, 60vw',
+        'alt': element.caption,
+        'style': 'max-width: 60%; display: flex; align-self: center;',
+    })
+    return format_html(
+        """
+        <a data-fslightbox href="{}">
             <figure class="embed-container">
-                <img style="max-width: 60%; display: flex; align-self: center;" src="{0}" alt="{1}">
-            <figcaption>{1}</figcaption>
+                {}
+            <figcaption>{}</figcaption>
             </figure>
         </a>
-        """, element.file.url, element.caption)  # noqa: E501
-    )
+        """, element.file.url, picture, element.caption)
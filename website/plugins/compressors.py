@@ -4,12 +4,19 @@ from io import BytesIO
 from PIL import Image
 from django.core.files import File
 
+# MIME types of the formats renditions are saved in
+RENDITION_TYPES = {
+    'WEBP': 'image/webp',
+    'PNG': 'image/png',
+    'JPEG': 'image/jpeg',
+}
+
 
 def compress_image(image, return_bytes=False):
     """Convert and compress an image."""
     pillow_image = Image.open(image)
     image_bytes_io = BytesIO()
-    pillow_image.thumbnail((1000, 1000), Image.ANTIALIAS)
+    pillow_image.thumbnail((1000, 1000), Image.LANCZOS)
 
     if pillow_image.format == "PNG":
         pillow_image.save(image_bytes_io, 'PNG', optimize=True)
@@ -21,3 +28,40 @@ def compress_image(image, return_bytes=False):
 
     new_image = File(image_bytes_io, name=image.name)
     return new_image
+
+
+def make_renditions(image, widths):
+    """
+    Resize an image to several widths, in WebP and its original format.
+
+    Images are never scaled up, so widths larger than the image are replaced
+    by a single rendition at the image's own width. PNGs keep a PNG fallback,
+    anything else falls back to JPEG.
+
+    Args:
+        image: path or file object of the image
+        widths: the widths in pixels to resize to
+
+    Returns:
+        list of (width, format, BytesIO) tuples, in order of width
+
+    """
+    pillow_image = Image.open(image)
+    fallback = 'PNG' if pillow_image.format == 'PNG' else 'JPEG'
+    if fallback == 'JPEG' and pillow_image.mode != 'RGB':
+        pillow_image = pillow_image.convert('RGB')
+
+    widths = sorted({min(width, pillow_image.width) for width in widths})
+    renditions = []
+    for width in widths:
+        height = round(pillow_image.height * width / pillow_image.width)
+        height = max(height, 1)
+        resized = pillow_image.resize((width, height), Image.LANCZOS)
+        for fmt in ('WEBP', fallback):
+            data = BytesIO()
+            if fmt == 'PNG':
+                resized.save(data, fmt, optimize=True)
+            else:
+                resized.save(data, fmt, quality=80 if fmt == 'WEBP' else 85)
+            renditions.append((width, fmt, data))
+    return renditions
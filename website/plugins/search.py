@@ -0,0 +1,152 @@
+"""In-memory search over school names for the sign up form."""
+
+import re
+import threading
+from collections import Counter, defaultdict
+
+from website.caching import get_version
+from website.models import School
+
+MAX_PREFIX = 10  # longer query words are checked against the full word
+MIN_SIMILARITY = 0.5  # fraction of the query's trigrams found in the name
+
+
+def _words(text):
+    """Split text into lowercase alphanumeric words."""
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def _trigrams(words):
+    """Return the set of trigrams of some words, padded like pg_trgm."""
+    trigrams = set()
+    for word in words:
+        padded = f"  {word} "
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+class SchoolIndex:
+    """
+    Prefix and trigram index over school names.
+
+    Searches first match schools where every query word is a prefix of a
+    word in the name (so "syd boys" finds "Sydney Boys High School"), then
+    fall back to trigram similarity to tolerate typos.
+    """
+
+    def __init__(self, schools):
+        """
+        Build the index.
+
+        Args:
+            schools: iterable of (id, name, region) tuples
+
+        """
+        self.schools = {}
+        self.words = {}
+        self.trigram_counts = {}
+        self.prefixes = defaultdict(set)
+        self.trigrams = defaultdict(set)
+
+        for school_id, name, region in schools:
+            words = _words(name)
+            trigrams = _trigrams(words)
+            self.schools[school_id] = (name, region)
+            self.words[school_id] = words
+            self.trigram_counts[school_id] = len(trigrams)
+            for word in words:
+                for end in range(1, min(len(word), MAX_PREFIX) + 1):
+                    self.prefixes[word[:end]].add(school_id)
+            for trigram in trigrams:
+                self.trigrams[trigram].add(school_id)
+
+    def _prefix_matches(self, words):
+        """Return ids of schools that have a word starting with each word."""
+        candidates = None
+        for word in words:
+            ids = self.prefixes.get(word[:MAX_PREFIX], set())
+            candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                return set()
+        long_words = [word for word in words if len(word) > MAX_PREFIX]
+        return {
+            school_id for school_id in candidates
+            if all(any(name_word.startswith(word)
+                       for name_word in self.words[school_id])
+                   for word in long_words)
+        }
+
+    def _similar(self, words):
+        """
+        Return (similarity, id) of schools that share enough trigrams.
+
+        Like pg_trgm's word_similarity, this measures how much of the query
+        is found in the name, so short queries can match long names.
+        """
+        trigrams = _trigrams(words)
+        shared = Counter()
+        for trigram in trigrams:
+            shared.update(self.trigrams.get(trigram, ()))
+        for school_id, count in shared.items():
+            similarity = count / len(trigrams)
+            if similarity >= MIN_SIMILARITY:
+                yield similarity, school_id
+
+    def search(self, query, region=None, limit=10):
+        """
+        Find schools matching a query.
+
+        Args:
+            query: text typed by the user
+            region: only return schools in this region, if given
+            limit: maximum number of results
+
+        Returns:
+            list of (id, name, region) tuples, best matches first
+
+        """
+        words = _words(query)
+        if not words:
+            return []
+
+        def in_region(school_id):
+            return region is None or self.schools[school_id][1] == region
+
+        prefix_ids = sorted(
+            filter(in_region, self._prefix_matches(words)),
+            key=lambda school_id: self.schools[school_id][0].lower())
+        results = prefix_ids[:limit]
+        if len(results) < limit:
+            seen = set(results)
+            similar = sorted(
+                (-similarity, self.trigram_counts[school_id], school_id)
+                for similarity, school_id in self._similar(words)
+                if school_id not in seen and in_region(school_id))
+            results += [school_id for _, _, school_id in similar]
+
+        return [(school_id, *self.schools[school_id])
+                for school_id in results[:limit]]
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def get_school_index():
+    """
+    Return this worker's school index, building it if needed.
+
+    The index is rebuilt when the "schools" cache version changes, which
+    happens whenever a school is saved, deleted or loaded.
+    """
+    global _index, _index_version
+    version = get_version("schools")
+    if _index is None or _index_version != version:
+        with _index_lock:
+            if _index is None or _index_version != version:
+                _index = SchoolIndex(
+                    School.objects.filter(active=True)
+                    .values_list("id", "name", "region"))
+                _index_version = version
+    return _index
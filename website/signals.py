@@ -0,0 +1,77 @@
+"""Signal receivers for the CompClub website."""
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from website.caching import bump_version
+from website.models import Event, EventPlugin, Registration, School, Workshop
+
+
+def bump_content_version(event_id):
+    """Invalidate the cached content of an event and mark it modified."""
+    Event.objects.filter(pk=event_id).update(
+        content_version=F('content_version') + 1,
+        updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Event)
+def event_saved(sender, instance, **kwargs):
+    """Invalidate cached content when an event is saved."""
+    bump_content_version(instance.pk)
+
+
+def event_plugin_changed(sender, instance, **kwargs):
+    """Invalidate the cached content of the event a plugin belongs to."""
+    bump_content_version(instance.parent_id)
+
+
+for plugin in EventPlugin.__subclasses__():
+    post_save.connect(event_plugin_changed, sender=plugin)
+    post_delete.connect(event_plugin_changed, sender=plugin)
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+@receiver(post_save, sender=Workshop)
+@receiver(post_delete, sender=Workshop)
+def event_list_changed(sender, **kwargs):
+    """Invalidate cached pages that list events."""
+    bump_version('page')
+
+
+@receiver(post_save, sender=School)
+@receiver(post_delete, sender=School)
+def school_changed(sender, **kwargs):
+    """Rebuild the school search index in every worker."""
+    bump_version('schools')
+
+
+@receiver(post_delete, sender=Registration)
+def registration_deleted(sender, instance, **kwargs):
+    """Give back a deleted registration's seats to the waitlist."""
+    if instance.status == Registration.CONFIRMED:
+        instance.release_seats()
+        Registration.promote_waitlist(instance.event_id, limit=1)
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_save, sender=Workshop)
+def capacity_changed(sender, instance, created, **kwargs):
+    """Confirm waitlisted registrations when capacity is added."""
+    if not created and instance.capacity_increased:
+        Registration.promote_waitlist(
+            instance.pk if sender is Event else instance.event_id)
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """Tune new SQLite connections with the SQLITE_PRAGMAS setting."""
+    if connection.vendor != 'sqlite' or not settings.SQLITE_PRAGMAS:
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
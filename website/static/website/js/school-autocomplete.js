@@ -0,0 +1,56 @@
+/* Search for schools as the user types, see website.forms.SchoolAutocomplete */
+(function () {
+
+    function attach(select) {
+        var url = select.getAttribute('data-autocomplete-url');
+        var search = document.createElement('input');
+        search.type = 'search';
+        search.className = 'form-control';
+        search.placeholder = 'Search for your school';
+        search.setAttribute('autocomplete', 'off');
+        select.parentNode.insertBefore(search, select);
+
+        var timer = null;
+        var latest = 0;
+
+        function update(results) {
+            var selected = select.value;
+            var keep = null;
+            Array.prototype.forEach.call(select.options, function (option) {
+                if (option.value === selected) {
+                    keep = option;
+                }
+            });
+            select.innerHTML = '';
+            if (keep) {
+                select.appendChild(keep);
+            }
+            results.forEach(function (school) {
+                if (String(school.id) === selected) {
+                    return;
+                }
+                var option = document.createElement('option');
+                option.value = school.id;
+                option.textContent = school.name;
+                select.appendChild(option);
+            });
+        }
+
+        search.addEventListener('input', function () {
+            clearTimeout(timer);
+            timer = setTimeout(function () {
+                var request = ++latest;
+                fetch(url + '?q=' + encodeURIComponent(search.value))
+                    .then(function (response) { return response.json(); })
+                    .then(function (data) {
+                        // Ignore responses to searches that have been superseded
+                        if (request === latest) {
+                            update(data.results);
+                        }
+                    });
+            }, 200);
+        });
+    }
+
+    document.querySelectorAll('select[data-autocomplete-url]').forEach(attach);
+})();
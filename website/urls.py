@@ -30,6 +30,7 @@ urlpatterns = [
          auth_views.LoginView.as_view(redirect_authenticated_user=True),
          name='login'),
     path('signup/', views.SignUpPage.as_view(), name='signup'),
+    path('schools/', views.SchoolSearch.as_view(), name='school_search'),
     path('logout/', auth_views.LogoutView.as_view(), name='logout'),
     path('', views.Index.as_view(), name='index'),
     path('events/', views.EventIndex.as_view(), name='event_index'),
@@ -40,6 +41,7 @@ urlpatterns = [
          staff_member_required(views.EventCreate.as_view()),
          name='event_create'),
     path('about/', views.AboutView.as_view(), name='about'),
+    path('api/events/', views.EventAPI.as_view(), name='event_api'),
     path('events/<slug:slug>-<int:event_id>/status-email-preview',
          staff_member_required(views.VolunteerStatusEmailPreview.as_view()),
          name='volunteer_email_preview'),
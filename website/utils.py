@@ -1,9 +1,13 @@
 """Utility functions."""
 
+import datetime
+from itertools import groupby
+from operator import attrgetter
+
 from django.conf import settings
-from django.db.models import Prefetch
+from django.db import transaction
 from django.shortcuts import get_object_or_404
-from website.models import Event, Volunteer, Workshop
+from website.models import EmailJob, Event, QueuedEmail, VolunteerAssignment
 
 STATUS_EMAIL_SUBJECT = "Your Assignment For Event \"{event}\""
 STATUS_EMAIL_BASE = """
@@ -20,53 +24,143 @@ STATUS_EMAIL_WORKSHOP_FMT = \
     "{workshop_name}({start_time}-{end_time}): {status}\n"
 
 
-def generate_status_email(event_id,
-                          subject=STATUS_EMAIL_SUBJECT,
-                          base=STATUS_EMAIL_BASE,
-                          workshop_fmt=STATUS_EMAIL_WORKSHOP_FMT,
-                          from_email=settings.EMAIL):
+def iter_status_emails(event,
+                       subject=STATUS_EMAIL_SUBJECT,
+                       base=STATUS_EMAIL_BASE,
+                       workshop_fmt=STATUS_EMAIL_WORKSHOP_FMT,
+                       from_email=settings.EMAIL):
     """
-    Generate workshop assignment status for volunteers.
+    Yield workshop assignment status emails for volunteers, one at a time.
+
+    Every assignment in the event is read in a single joined query, ordered
+    by volunteer, and streamed so memory use doesn't grow with the number of
+    volunteers.
 
     Args:
-        event_id: id of event to generate email for
+        event: the Event to generate emails for
         subject: common subject for emails, with `event` as named parameters
         base: base template for the body of the email, with `recipient`,
               `event` and `body` as named parameters
         workshop_fmt: workshop description format, with `workshop_name`,
                       `start_time`, `end_time` and `status` as named parameters
 
-    Returns:
-        list of emails in the following format:
-            [(subject, message, from_email, [recipient.email])]
+    Yields:
+        emails in the format (subject, message, from_email, [recipient.email])
 
     """
-    event = get_object_or_404(Event, pk=event_id)
-    recipients = Volunteer.objects \
-        .filter(assignment__workshop__event=event) \
-        .prefetch_related(
-            Prefetch(
-                'workshops_assigned',
-                queryset=Workshop.objects.filter(event=event)
-            ),
-            'assignment'
-        ) \
-        .select_related('user')
+    assignments = VolunteerAssignment.objects \
+        .filter(workshop__event=event) \
+        .select_related('volunteer__user', 'workshop') \
+        .order_by('volunteer_id', 'workshop__name') \
+        .iterator()
     subject = subject.format(event=event.name)
-    emails = []
-    for recipient in recipients:
+    for _, volunteer_assignments in groupby(assignments,
+                                            key=attrgetter('volunteer_id')):
         workshop_msg = str()
-        for assignment in recipient.assignment.filter(
-                workshop__event=event).order_by('workshop__name'):
+        for assignment in volunteer_assignments:
             workshop_msg += workshop_fmt.format(
                 workshop_name=assignment.workshop.name,
                 start_time=assignment.workshop.start_time,
                 end_time=assignment.workshop.end_time,
                 status=assignment.get_status_display())
-        formatted_message = base.format(recipient=recipient.user.first_name,
+        user = assignment.volunteer.user
+        formatted_message = base.format(recipient=user.first_name,
                                         event=event.name,
                                         body=workshop_msg)
-        data_tuple = (subject, formatted_message, from_email,
-                      [recipient.user.email])
-        emails.append(data_tuple)
-    return emails
+        yield (subject, formatted_message, from_email, [user.email])
+
+
+def generate_status_email(event_id, **kwargs):
+    """
+    Generate workshop assignment status for volunteers.
+
+    Args:
+        event_id: id of event to generate email for
+        **kwargs: formats passed on to iter_status_emails
+
+    Returns:
+        list of emails in the following format:
+            [(subject, message, from_email, [recipient.email])]
+
+    """
+    event = get_object_or_404(Event, pk=event_id)
+    return list(iter_status_emails(event, **kwargs))
+
+
+def queue_emails(datatuple, event=None, created_by=None):
+    """
+    Queue emails to be sent by the send_queued_email management command.
+
+    Args:
+        datatuple: emails in the format accepted by send_mass_mail, i.e.
+            (subject, message, from_email, recipient_list) tuples
+        event: the event the emails are about, if any
+        created_by: the user who queued the emails
+
+    Returns:
+        the created EmailJob
+
+    """
+    with transaction.atomic():
+        job = EmailJob.objects.create(event=event, created_by=created_by)
+        emails = QueuedEmail.objects.bulk_create(
+            QueuedEmail(job=job,
+                        subject=subject,
+                        body=message,
+                        from_email=from_email,
+                        recipient=recipient)
+            for subject, message, from_email, recipients in datatuple
+            for recipient in recipients)
+        job.total = len(emails)
+        job.save(update_fields=['total'])
+    return job
+
+
+def recurrence_dates(start,
+                     interval=1,
+                     weekdays=None,
+                     skip=(),
+                     count=None,
+                     until=None):
+    """
+    Expand a recurrence rule into a list of dates.
+
+    The rule follows a small subset of RFC 5545 RRULEs: occurrences are
+    `interval` days apart starting at `start`, optionally restricted to some
+    days of the week. Skipped dates don't count towards `count`.
+
+    Args:
+        start: the date of the first occurrence, which is left out if it
+            isn't one of the weekdays
+        interval: number of days between occurrences
+        weekdays: collection of allowed weekdays (Monday is 0), or None to
+            allow every day
+        skip: collection of dates to leave out
+        count: maximum number of occurrences, including the first
+        until: last date an occurrence may fall on
+
+    Returns:
+        a sorted list of dates
+
+    """
+    if count is None and until is None:
+        raise ValueError('A recurrence needs a count or an until date')
+    if interval < 1:
+        raise ValueError('Recurrence interval must be at least one day')
+
+    skip = set(skip)
+    step = datetime.timedelta(days=interval)
+    dates = []
+    current = start
+    misses = 0
+    # weekdays repeat every 7 steps, so 7 misses in a row means no more dates
+    while ((until is None or current <= until)
+           and (count is None or len(dates) < count) and misses < 7):
+        if weekdays is not None and current.weekday() not in weekdays:
+            misses += 1
+        else:
+            misses = 0
+            if current not in skip:
+                dates.append(current)
+        current += step
+    return dates
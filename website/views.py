@@ -5,22 +5,28 @@ Contains functions to render views (i.e. pages) to the user as HTTP responses.
 For more information, see
 https://docs.djangoproject.com/en/2.1/topics/http/views/
 """
+import base64
+import binascii
 import logging
-from collections import namedtuple
-from datetime import datetime, date
-from smtplib import SMTPSenderRefused
+from collections import defaultdict, namedtuple
+from datetime import date
 
 from content_editor.contents import contents_for_item
+from django.conf import settings
 from django.contrib.auth import login
 from django.contrib.auth.models import Group
-from django.core.mail import BadHeaderError, send_mass_mail
+from django.core.cache import cache
+from django.core.files.storage import default_storage
 from django.db import transaction
-from django.db.models import Count
-from django.http import HttpResponse
+from django.db.models import Count, Prefetch, Q
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
+from django.utils.decorators import method_decorator
 from django.utils.html import mark_safe
 from django.views import View
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django.views.generic import DetailView, ListView, TemplateView
 from django.views.generic.edit import CreateView
 from django.contrib.auth.mixins import PermissionRequiredMixin
@@ -28,18 +34,23 @@ from django.http import Http404
 from django.contrib.humanize.templatetags.humanize import ordinal
 import calendar
 
+from website.caching import (PermissionPageCacheMixin, event_etag,
+                             event_list_etag)
 from website.forms import (CreateStudentForm, CreateUserForm, EventForm,
                            RegistrationForm, VolunteerAssignForm, WorkshopForm)
 from website.models import (Download, Event, LightBox, NoEmbed, Registration,
-                            RichText, Workshop)
+                            RichText, School, Volunteer, VolunteerAssignment,
+                            Workshop)
 from website.plugins import cms
-from website.utils import generate_status_email
+from website.plugins.search import get_school_index
+from website.utils import iter_status_emails, queue_emails
 
 logger = logging.getLogger(__name__)
 DISPLAY_ERROR = "$DISPLAY_ERROR$"
 
 
-class Index(ListView):
+@method_decorator(condition(etag_func=event_list_etag), name='dispatch')
+class Index(PermissionPageCacheMixin, TemplateView):
     """
     Renders the home page to the user.
 
@@ -53,22 +64,24 @@ class Index(ListView):
 
     """
 
-    model = Event
     template_name = 'website/index.html'
+    page_cache_permissions = ('website.view_hidden_event',)
 
     def get_context_data(self, **kwargs):
-        """Return current/future events sorted by start date."""
+        """Return current/future highlighted events sorted by start date."""
         context = super().get_context_data(**kwargs)
 
-        context['events_list'] = Event.objects.filter(
-            highlighted_event=True,
-            finish_date__gte=datetime.now()
-        ) .order_by('start_date')
+        context['events_list'] = Event.objects \
+            .visible_to(self.request.user) \
+            .current() \
+            .filter(highlighted_event=True) \
+            .order_by('start_date')
 
         return context
 
 
-class EventIndex(ListView):
+@method_decorator(condition(etag_func=event_list_etag), name='dispatch')
+class EventIndex(PermissionPageCacheMixin, ListView):
     """
     Render and show events page to the user.
 
@@ -83,21 +96,21 @@ class EventIndex(ListView):
 
     """
 
-    model = Event
     template_name = 'website/event_index.html'
-
-    def get_context_data(self, **kwargs):
-        """Return future events sorted by start date."""
-        context = super().get_context_data(**kwargs)
-
-        context['events_list'] = Event.objects \
-            .filter(finish_date__gte=datetime.now()) \
+    context_object_name = 'events_list'
+    page_cache_permissions = ('website.view_event',
+                              'website.view_hidden_event')
+
+    def get_queryset(self):
+        """Return current/future events visible to the user by start date."""
+        return Event.objects \
+            .visible_to(self.request.user) \
+            .current() \
             .annotate(n_workshops=Count('workshop')) \
             .order_by('start_date')
 
-        return context
-
 
+@method_decorator(condition(etag_func=event_etag), name='dispatch')
 class EventPage(PermissionRequiredMixin, DetailView):
     """
     Render and show event detail page to the user.
@@ -127,12 +140,9 @@ class EventPage(PermissionRequiredMixin, DetailView):
         return context
 
     def get(self, request, event_id, slug):  # noqa: D102
-        # check if url is valid
-        event = get_object_or_404(Event, pk=event_id)
-
-        if (event.hidden_event and not self.request.user.has_perms(
-                "website.view_hidden_event")):
-            self.handle_no_permission()
+        # check if url is valid; hidden events don't exist for most users
+        event = get_object_or_404(Event.objects.visible_to(request.user),
+                                  pk=event_id)
 
         if event.slug != slug:
             return redirect('website:event_page',
@@ -152,26 +162,54 @@ class EventPage(PermissionRequiredMixin, DetailView):
                 "website.view_unreleased_event")):
             raise Http404(self.get_unreleased_message().format("", "soon"))
 
-        contents = contents_for_item(
-            event, [RichText, Download, NoEmbed, LightBox])
         return render(request, self.template_name, {
             "event": event,
-            "content": {
-                region.key: mark_safe(
-                    "".join(self._render_elements(contents[region.key])))
-                for region in event.regions
-            },
+            "content": self.get_content(event),
         })
 
-    def _render_elements(self, elements):
-        """Render django-content-editor elements."""
+    def get_content(self, event):
+        """
+        Return the rendered content regions of an event.
+
+        Rendered regions are cached under the event's content version, which
+        changes whenever the event or any of its plugins is saved or deleted.
+        Content with an embed that couldn't be looked up isn't cached, so the
+        embed is tried again on a later view.
+        """
+        key = f"event-content:{event.pk}:{event.content_version}"
+        content = cache.get(key)
+        if content is None:
+            contents = contents_for_item(
+                event, [RichText, Download, NoEmbed, LightBox])
+            cms.prefetch_noembeds(element.url for element in contents
+                                  if isinstance(element, NoEmbed))
+            fallbacks = []
+            content = {
+                region.key: "".join(
+                    self._render_elements(contents[region.key], fallbacks))
+                for region in event.regions
+            }
+            if not fallbacks:
+                cache.set(key, content, settings.EVENT_CONTENT_CACHE_TTL)
+
+        return {region: mark_safe(html) for region, html in content.items()}
+
+    def _render_elements(self, elements, fallbacks):
+        """
+        Render django-content-editor elements.
+
+        Embeds rendered as a plain link are added to fallbacks.
+        """
         for element in elements:
             if isinstance(element, RichText):
                 yield cms.render_rich_text(element)
             elif isinstance(element, Download):
                 yield cms.render_download(element)
             elif isinstance(element, NoEmbed):
-                yield cms.render_noembed(element)
+                html, fallback = cms.render_noembed(element)
+                if fallback:
+                    fallbacks.append(element)
+                yield html
             elif isinstance(element, LightBox):
                 yield cms.render_lightbox(element)
 
@@ -192,6 +230,155 @@ class EventPage(PermissionRequiredMixin, DetailView):
         raise Http404(self.get_permission_denied_message())
 
 
+class EventAPI(PermissionRequiredMixin, View):
+    """
+    Return a page of events and their workshops as JSON.
+
+    Events are visible under the same rules as the event page, and are
+    paginated by keyset on (start_date, id) so every page costs the same
+    regardless of how deep the client pages.
+
+    Args:
+        request: HTTP request header contents. Accepts the query parameters
+            `after` (the `next` cursor of the previous page), `limit` (page
+            size) and `fields` (comma separated list of fields to return).
+
+    Returns:
+        JSON response of the form {"results": [...], "next": cursor}, where
+        `next` is null on the last page
+
+    """
+
+    permission_required = "website.view_event"
+    raise_exception = True
+    page_size = 20
+    max_page_size = 100
+    event_fields = ("name", "slug", "start_date", "finish_date",
+                    "description", "display_image")
+    workshop_fields = ("name", "date", "start_time", "end_time", "location")
+    all_fields = ("id", "url", "workshops") + event_fields
+
+    def get(self, request):  # noqa: D102
+        try:
+            fields = self.get_fields(request.GET.get("fields"))
+            limit = min(int(request.GET.get("limit", self.page_size)),
+                        self.max_page_size)
+            events = self.get_queryset(request.GET.get("after"))
+        except ValueError as error:
+            return JsonResponse({"error": str(error)}, status=400)
+        if limit < 1:
+            return JsonResponse({"error": "limit must be positive"},
+                                status=400)
+
+        columns = {"id", "slug", "start_date"}.union(
+            fields.intersection(self.event_fields))
+        rows = list(events.values(*columns)[:limit + 1])
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self.encode_cursor(rows[-1])
+
+        workshops = defaultdict(list)
+        if "workshops" in fields:
+            for workshop in Workshop.objects \
+                    .filter(event_id__in=[row["id"] for row in rows]) \
+                    .order_by("date", "start_time") \
+                    .values("event_id", *self.workshop_fields):
+                workshops[workshop.pop("event_id")].append(workshop)
+
+        results = []
+        for row in rows:
+            row["url"] = reverse("website:event_page", kwargs={
+                "slug": row["slug"], "event_id": row["id"]})
+            row["workshops"] = workshops[row["id"]]
+            if row.get("display_image"):
+                row["display_image"] = default_storage.url(
+                    row["display_image"])
+            results.append({field: row[field] for field in self.all_fields
+                            if field in fields})
+
+        return JsonResponse({"results": results, "next": next_cursor},
+                            json_dumps_params={"separators": (",", ":")})
+
+    def get_fields(self, fields):
+        """Parse the requested field list."""
+        if not fields:
+            return set(self.all_fields)
+        requested = set(fields.split(","))
+        unknown = requested.difference(self.all_fields)
+        if unknown:
+            raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+        return requested
+
+    def get_queryset(self, cursor):
+        """Return the visible events after the cursor, in keyset order."""
+        events = Event.objects \
+            .released_to(self.request.user) \
+            .current() \
+            .order_by("start_date", "id")
+        if cursor:
+            start_date, event_id = self.decode_cursor(cursor)
+            events = events.filter(
+                Q(start_date__gt=start_date)
+                | Q(start_date=start_date, id__gt=event_id))
+        return events
+
+    @staticmethod
+    def encode_cursor(row):
+        """Return an opaque cursor pointing just after an event row."""
+        key = f"{row['start_date'].isoformat()},{row['id']}"
+        return base64.urlsafe_b64encode(key.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """Return the (start_date, id) key encoded in a cursor."""
+        try:
+            start_date, event_id = base64.urlsafe_b64decode(
+                cursor.encode()).decode().split(",")
+            return date.fromisoformat(start_date), int(event_id)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise ValueError("invalid cursor")
+
+
+@method_decorator(cache_control(public=True, max_age=300), name='dispatch')
+class SchoolSearch(View):
+    """
+    Return schools matching a search as JSON, for the sign up form.
+
+    Args:
+        request: HTTP request header contents. Accepts the query parameters
+            `q` (search text), `region` (a School region code) and `limit`.
+
+    Returns:
+        JSON response of the form {"results": [{"id", "name", "region"}]}
+
+    """
+
+    page_size = 10
+    max_page_size = 50
+
+    def get(self, request):  # noqa: D102
+        region = request.GET.get("region") or None
+        if region and region not in dict(School.REGION_CHOICES):
+            return JsonResponse({"error": "unknown region"}, status=400)
+        try:
+            limit = min(int(request.GET.get("limit", self.page_size)),
+                        self.max_page_size)
+        except ValueError:
+            return JsonResponse({"error": "invalid limit"}, status=400)
+        if limit < 1:
+            return JsonResponse({"error": "limit must be positive"},
+                                status=400)
+
+        schools = get_school_index().search(request.GET.get("q", ""),
+                                            region=region,
+                                            limit=limit)
+        return JsonResponse({"results": [
+            {"id": school_id, "name": name, "region": region}
+            for school_id, name, region in schools
+        ]}, json_dumps_params={"separators": (",", ":")})
+
+
 class SignUpPage(CreateView):
     """
     Render and show student sign up form to the user.
@@ -278,25 +465,42 @@ class RegistrationPage(CreateView):
     template_name = 'website/registration_form.html'
     model = Registration
 
+    def dispatch(self, request, *args, **kwargs):  # noqa: D102
+        self.event = get_object_or_404(
+            Event.objects.released_to(request.user), pk=kwargs['event_id'])
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_form(self, form_class=None):
+        """Only accept registrations for events the user can see."""
+        form = super().get_form(form_class)
+        form.fields['event'].queryset = Event.objects.released_to(
+            self.request.user)
+        form.fields['event'].initial = self.event
+        # students pick a workshop when workshops have their own capacity
+        workshops = self.event.workshop.order_by('date', 'start_time')
+        if any(workshop.capacity is not None for workshop in workshops):
+            form.fields['workshop'].queryset = workshops
+            form.fields['workshop'].required = True
+            form.fields['workshop'].label_from_instance = lambda workshop: (
+                f'{workshop.name} ({workshop.date:%d %b})'
+                + (' - waitlist' if workshop.seats_left == 0 else ''))
+        else:
+            del form.fields['workshop']
+        return form
+
     def get_context_data(self, **kwargs):  # noqa: D102
         context = super().get_context_data(**kwargs)
-
-        event = Event.objects.get(id=self.kwargs['event_id'])
-        registration_form = self.get_form()
-        registration_form.fields['event'].initial = event
-
-        context['registration_form'] = registration_form
-        context['event'] = event
+        context['registration_form'] = context['form']
+        context['event'] = self.event
 
         return context
 
     def get(self, request, event_id, slug):  # noqa: D102
         # check if url is valid
-        event = get_object_or_404(Event, pk=event_id)
-        if event.slug != slug:
+        if self.event.slug != slug:
             return redirect('website:registration',
-                            event_id=event.pk,
-                            slug=event.slug)
+                            event_id=self.event.pk,
+                            slug=self.event.slug)
 
         return super().get(request, event_id, slug)
 
@@ -331,9 +535,11 @@ class VolunteerStatusEmailPreview(View):
     Render and show an email preview page.
 
     This view should be shown after assigning volunteers to workshops in an
-    event. If a POST request is sent, an email will be sent to the listed
-    volunteers whether they are assigned, on a waitlist or declined. Only staff
-    members can access and see this page.
+    event. If a POST request is sent, an email is queued for each listed
+    volunteer saying whether they are assigned, on a waitlist or declined.
+    The page shows the progress of the queued jobs, which are sent by the
+    send_queued_email management command. Only staff members can access and
+    see this page.
 
     Args:
         request: HTTP request header contents
@@ -348,8 +554,13 @@ class VolunteerStatusEmailPreview(View):
     template_name = 'website/volunteer_status_email_preview.html'
 
     def get_context_data(self, event_id):  # noqa: D102
-        emails = generate_status_email(event_id)
-        context = {'emails': emails}
+        event = get_object_or_404(Event, pk=event_id)
+        emails = list(iter_status_emails(event))
+        context = {
+            'event': event,
+            'emails': emails,
+            'jobs': event.email_jobs.select_related('created_by')[:10],
+        }
         return context
 
     def get(self, request, event_id, slug):  # noqa: D102
@@ -357,26 +568,22 @@ class VolunteerStatusEmailPreview(View):
         return render(request, self.template_name, context)
 
     def post(self, request, event_id, slug):  # noqa: D102
-        emails = self.get_context_data(event_id)['emails']
-        try:
-            send_mass_mail(emails)
-            return redirect('website:event_index')
-        except BadHeaderError as e:
-            logger.exception(e)
-            return HttpResponse('Invalid header found')
-        except SMTPSenderRefused as e:
-            logger.exception(e)
-            return HttpResponse('Failed to send email. The host may not have '
-                                'correctly configured the SMTP settings.')
+        context = self.get_context_data(event_id)
+        queue_emails(context['emails'],
+                     event=context['event'],
+                     created_by=request.user)
+        return redirect('website:volunteer_email_preview',
+                        event_id=event_id,
+                        slug=slug)
 
 
 class EventAssignVolunteers(View):
     """
     Render and show a volunteer assignment page.
 
-    The page shows a series of forms allowing a staff member to assign
-    volunteers to workshops for a particular event. Only staff members can
-    access and see this page.
+    The page shows the volunteers available for every workshop of a
+    particular event, and lets a staff member assign them all in a single
+    submission. Only staff members can access and see this page.
 
     Args:
         request: HTTP request header contents
@@ -390,42 +597,67 @@ class EventAssignVolunteers(View):
 
     template_name = 'website/event_assign.html'
 
-    def get_context_data(self, event_id):  # noqa: D102
-        event = get_object_or_404(Event, pk=event_id)
-        workshops = event.workshop.all().order_by('start_time')
-        forms = [
-            VolunteerAssignForm(initial={'workshop_id': w.id},
-                                available=w.available.all(),
-                                assignments=w.assignment.all())
-            for w in workshops
-        ]
-
-        WorkshopTuple = namedtuple('WorkshopTuple', ['model', 'form'])
-        tuples = [WorkshopTuple(w, f) for w, f in zip(workshops, forms)]
+    def get_forms(self, event, data=None):
+        """
+        Return a (workshop, form) pair for every workshop of the event.
+
+        Workshops, availabilities, assignments and users are loaded in a
+        fixed number of queries, however many volunteers there are. Each form
+        is prefixed with its workshop so they can share one submission, and
+        the workshop id can't be changed by the submitted data.
+        """
+        workshops = event.workshop.order_by('start_time').prefetch_related(
+            Prefetch('available',
+                     queryset=Volunteer.objects.select_related('user')),
+            Prefetch('assignment',
+                     queryset=VolunteerAssignment.objects.select_related(
+                         'volunteer__user')))
+
+        pairs = []
+        for w in workshops:
+            form = VolunteerAssignForm(data,
+                                       prefix=f'workshop-{w.id}',
+                                       initial={'workshop_id': w.id},
+                                       available=w.available.all(),
+                                       assignments=w.assignment.all())
+            form.fields['workshop_id'].disabled = True
+            pairs.append((w, form))
+        return pairs
+
+    def get_context_data(self, event, forms):  # noqa: D102
+        WorkshopTuple = namedtuple(
+            'WorkshopTuple', ['model', 'form', 'unassigned', 'withdrawn'])
+        tuples = [WorkshopTuple(w, form, w.unassigned(), w.withdrawn())
+                  for w, form in forms]
         context = {'event': event, 'workshops': tuples}
 
         return context
 
     def get(self, request, event_id, slug):  # noqa: D102
-        context = self.get_context_data(event_id)
+        event = get_object_or_404(Event, pk=event_id)
+        context = self.get_context_data(event, self.get_forms(event))
 
         return render(request, self.template_name, context)
 
-    def post(self, request, event_id, slug):  # noqa: D102
-        if 'workshop_id' in request.POST:
-            workshop = get_object_or_404(Workshop,
-                                         pk=request.POST['workshop_id'])
-
-            post_form = VolunteerAssignForm(
-                request.POST,
-                available=workshop.available.all(),
-                assignments=workshop.assignment.all())
-
-            if post_form.is_valid():
-                post_form.save()
-                return redirect('website:assign_volunteers',
-                                event_id=event_id,
-                                slug=slug)
+    def post(self, request, event_id, slug):
+        """Validate every workshop's assignments and save them together."""
+        event = get_object_or_404(Event, pk=event_id)
+        forms = self.get_forms(event, request.POST)
+
+        # validate every form so all errors are shown at once
+        if all([form.is_valid() for _, form in forms]):
+            new, changed = [], []
+            for _, form in forms:
+                form_new, form_changed = form.get_changes()
+                new += form_new
+                changed += form_changed
+            VolunteerAssignForm.save_changes(new, changed)
+            return redirect('website:assign_volunteers',
+                            event_id=event_id,
+                            slug=slug)
+
+        context = self.get_context_data(event, forms)
+        return render(request, self.template_name, context)
 
 
 class WorkshopCreate(CreateView):
@@ -465,7 +697,7 @@ class WorkshopCreate(CreateView):
         return reverse('website:event_page', kwargs=self.kwargs)
 
 
-class AboutView(TemplateView):
+class AboutView(PermissionPageCacheMixin, TemplateView):
     """
     Render and show the about page.
 